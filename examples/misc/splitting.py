@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+#
+# splitting.py
+#
+# A demonstration of qudy.  In this example we compare the accuracy
+# and the run time of the Trotter solver with the splitting solvers,
+# which evaluate the controls between samples by interpolation.  The
+# pulse is the one of functions.py, a field rotating in the xy plane,
+# for which the propagator is known in closed form.
+#
+# Copyright (C) 2011, 2012 True Merrill
+# Georgia Institute of Technology
+# School of Chemistry and Biochemistry
+
+from qudy import *
+from qudy.quantop import *
+from time import time
+
+# Set up some control functions
+ux = lambda t: cos( pi * t )
+uy = lambda t: sin( pi * t )
+uz = lambda t: 0
+
+# In a frame rotating with the field the Hamiltonian is constant, so
+# U(1) = exp( -i pi Z/2 ) exp( -i ( X - pi Z ) / 2 ).
+[X, Y, Z] = product_operator( 1 )
+exact = operator( expm( -1j * pi * Z ) ) * \
+        operator( expm( -1j * ( X - pi * Z ) ) )
+
+print '%-10s %8s %12s %12s' %( 'method', 'samples', 'time (s)', 'error' )
+
+for method in ['trotter', 'midpoint', 'yoshida', 'cfm4']:
+
+    # The Trotter solver holds each sample, the splitting solvers
+    # interpolate linearly between samples.
+    if method == 'trotter':
+        interpolation = 'latest'
+    else:
+        interpolation = 'linear'
+
+    for samples in [ 10, 100, 1000, 10000 ]:
+
+        dt = 1.0 / samples
+        t = arange( 0, 1 + dt / 2, dt )
+        ctrl = control( ux, uy, uz, t, interpolation = interpolation )
+        U = propagator( ctrl, solution = method )
+
+        start = time()
+        V = U.solve()
+        elapsed = time() - start
+
+        error = norm( V - exact, 2 )
+        print '%-10s %8i %12.2E %12.2E' %( method, samples, elapsed, error )
+
+# The error of the fourth order methods is set by the linear
+# interpolation of the samples, which is second order.  Against the
+# interpolated control itself, the fourth order of 'yoshida' and
+# 'cfm4' is seen by taking substeps on each slice.
+t = arange( 0, 1.05, 0.1 )
+ctrl = control( ux, uy, uz, t, interpolation = 'linear' )
+H = product_operator( 1 )
+reference = integration.splitting( ctrl, H, 'cfm4', substeps = 256 )
+
+print
+print '%-10s %8s %12s' %( 'method', 'substeps', 'error' )
+for method in ['midpoint', 'yoshida', 'cfm4']:
+    for substeps in [ 1, 2, 4, 8 ]:
+        V = integration.splitting( ctrl, H, method, substeps )
+        print '%-10s %8i %12.2E' %( method, substeps, norm( V - reference, 2 ) )
+
+# The adaptive solver takes the control functions themselves, and
+# chooses its steps to meet a tolerance on U.
+print
+print '%-10s %8s %12s %12s %12s' %( 'tolerance', 'steps', 'time (s)', \
+                                    'estimate', 'error' )
+for tol in [ 1e-4, 1e-6, 1e-8, 1e-10 ]:
+    start = time()
+    [V, info] = integration.adaptive( [ux, uy, uz], H, tol, \
+                                      interval = (0, 1), full_output = True )
+    elapsed = time() - start
+    print '%-10.0E %8i %12.2E %12.2E %12.2E' %( tol, info['steps'], elapsed, \
+          info['error'], norm( V - exact, 2 ) )
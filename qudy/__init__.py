@@ -3,12 +3,19 @@ version = '0.1'
 release = '0.1-alpha'
 
 # Import all of the submodules
+from composite import *
 from control import *
 from error import *
+from hamiltonian_set import *
 from imperfect import *
 from integration import *
+from local_operator import *
+from optimize import *
+from parametric import *
+from pauli import *
 from propagator import *
 from routines import *
+from su2 import *
 
 import plot
 import quantop
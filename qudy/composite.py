@@ -0,0 +1,314 @@
+# COMPOSITE.PY
+#
+# Search for composite pulse sequences
+#
+# Copyright (C) 2011, 2012 True Merrill
+# Georgia Institute of Technology
+# School of Chemistry and Biochemistry
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from quantop import *
+from numpy import asarray, dot, where, argsort, concatenate, array_split, \
+     mod, round as around, unique
+from numpy.random import RandomState
+from numpy.fft import fft
+from scipy.optimize import least_squares
+from multiprocessing import Pool
+import imperfect
+import su2
+
+__all__ = ['composite_search','composite_sequence']
+
+# Number of nodes and radius of the contour used to extract Taylor
+# coefficients in the error parameter.
+_NODES = 32
+_RADIUS = 0.5
+
+
+def composite_search( template, target, err = 'amplitude', order = 1, \
+                      **keyword_args ):
+    """
+    Searches for composite pulse sequences that cancel a systematic
+    error to a given order.  A sequence is described by a template of
+    rotations :math:`M(\\theta_i,\\phi_i)`, where any angle or phase may
+    be a free parameter.
+
+    **Forms:**
+
+       * ``composite_search( template, target )``
+       * ``composite_search( template, target, err, order )``
+       * ``composite_search( template, target, err, order, starts = n )``
+
+    **Args:**
+
+       * *template* : A list of (theta, phi) pairs, written in the same
+         order as the product ``M(theta_1,phi_1) * M(theta_2,phi_2) *
+         ...``, so the last pair is applied first.  Entries are either
+         numbers or strings naming a free parameter.  A name may carry
+         a sign or a numeric factor, e.g. ``'-phi'`` or ``'3*phi1'``.
+       * *target* : The target unitary, a 2 x 2 matrix.
+       * *err* : The error to cancel, either 'amplitude' or
+         'detuning'.  These follow the conventions of the amplitude
+         and detuning error models.
+       * *order* : Number of orders of the error to cancel.
+
+    **Optional keys:**
+
+       * starts = n : Number of random parameter vectors screened
+         before root finding.  The default is 4096.
+       * seeds = n : Number of the best screened vectors used to start
+         root finding.  The default is 64.
+       * processes = p : Number of worker processes used for root
+         finding.  By default the calling process is used.
+       * tol = x : Largest residual accepted as a solution.  The
+         default is 1E-10.
+       * random_state = r : Seed for the random number generator.
+
+    **Returns:**
+
+       * [names, solutions] : The names of the free parameters and an
+         array with one row of parameter values per distinct
+         solution.  Solutions related by the periodicity of the phases
+         or by reflecting all phases are returned only once.
+
+    For example, the SK1 sequence is recovered by
+
+    .. code-block:: python
+
+       template = [ (2*pi, '-phi'), (2*pi, 'phi'), (theta, 0) ]
+       [names, solutions] = composite_search( template, R(theta,0).solve() )
+
+    Every candidate is evaluated in closed form on the quaternion
+    (Cayley-Klein) parameters of SU(2), and thousands of candidates
+    are evaluated per batch.  Taylor coefficients in the error are
+    extracted exactly by sampling the sequence on a circle in the
+    complex error plane.
+    """
+
+    starts = keyword_args.get( 'starts', 4096 )
+    seeds = keyword_args.get( 'seeds', 64 )
+    processes = keyword_args.get( 'processes', None )
+    tol = keyword_args.get( 'tol', 1E-10 )
+    random = RandomState( keyword_args.get( 'random_state', None ) )
+
+    if not err in ['amplitude', 'detuning']:
+        raise ValueError('Error %s not understood.' %(err))
+
+    spec = _parse( template )
+    spec['target'] = su2.cayley_klein( target )
+    spec['error'] = err
+    spec['order'] = int( order )
+    names = spec['names']
+
+    # Screen random parameter vectors in one batch.  Phases are drawn
+    # from (0, 2 pi) and rotation angles from (0, 4 pi).
+    scale = where( spec['phase'], 2*pi, 4*pi )
+    x = random.uniform( size = (starts, len(names)) ) * scale
+    r = ( _residuals( x, spec )**2 ).sum( axis = 1 )
+    x = x[ argsort(r)[0:seeds] ]
+
+    # Multi-start root finding, optionally spread over a pool.
+    if processes is None:
+        found = _solve( (x, spec) )
+
+    else:
+        pool = Pool( processes )
+        try:
+            found = pool.map( _solve, \
+                [ (c, spec) for c in array_split( x, processes ) if len(c) ] )
+        finally:
+            pool.close()
+            pool.join()
+        found = concatenate( found )
+
+    # Keep converged solutions and remove duplicates.
+    found = found[ ( _residuals( found, spec )**2 ).sum( axis = 1 ) < tol**2 ]
+    solutions = _deduplicate( found, spec, tol )
+
+    return [names, solutions]
+
+
+def composite_sequence( template, names, values, err ):
+    """
+    Constructs the imperfect propagator for a composite pulse
+    sequence found by ``composite_search``.
+
+    **Forms:**
+
+       * ``composite_sequence( template, names, values, err )``
+
+    **Args:**
+
+       * *template* : The sequence template.
+       * *names* : Names of the free parameters.
+       * *values* : Values of the free parameters.
+       * *err* : An error object.
+
+    **Returns:**
+
+       * V : The product of the imperfect rotations.
+    """
+    spec = _parse( template )
+    order = [ spec['names'].index( name ) for name in names ]
+    x = asarray( values, float )[ argsort( order ) ]
+    theta = spec['theta0'] + dot( spec['theta'], x )
+    phi = spec['phi0'] + dot( spec['phi'], x )
+
+    V = imperfect.M( theta[0], phi[0], err )
+    for i in range( 1, len(theta) ):
+        V = V * imperfect.M( theta[i], phi[i], err )
+    return V
+
+
+def _parse( template ):
+    # Convert a template into linear maps from the free parameters to
+    # the rotation angles and phases, theta = theta0 + A x.
+    names = []
+    terms = []
+    for pair in template:
+        row = []
+        for entry in pair:
+            if isinstance( entry, str ):
+                s = entry.replace(' ', '')
+                sign = 1.0
+                if s[0] in '+-':
+                    sign = -1.0 if s[0] == '-' else 1.0
+                    s = s[1:]
+                if '*' in s:
+                    [factor, s] = s.split('*')
+                    sign = sign * float( factor )
+                if not s in names:
+                    names.append( s )
+                row.append( (0.0, sign, s) )
+            else:
+                row.append( (float(entry), 0.0, None) )
+        terms.append( row )
+
+    n = len(terms)
+    spec = { 'names' : names, 'theta0' : zeros(n), 'phi0' : zeros(n), \
+             'theta' : zeros( (n, len(names)) ), 'phi' : zeros( (n, len(names)) ) }
+    for i in range( n ):
+        for (j, key) in enumerate( ['theta', 'phi'] ):
+            [const, factor, name] = terms[i][j]
+            spec[key + '0'][i] = const
+            if name is not None:
+                spec[key][i, names.index(name)] = factor
+
+    # Parameters that only appear as phases are periodic.
+    spec['phase'] = ( abs( spec['theta'] ).sum( axis = 0 ) == 0 )
+    return spec
+
+
+def _series( x, spec ):
+    # Taylor coefficients of T^dagger U(epsilon) in the error
+    # parameter, for every row of x.  Shape (N, order + 1, 4).
+    theta = spec['theta0'] + dot( x, spec['theta'].T )
+    phi = spec['phi0'] + dot( x, spec['phi'].T )
+
+    # Rotation generators g(epsilon) = g0 + epsilon g1 on a circle in
+    # the complex plane.
+    epsilon = _RADIUS * exp( 2j * pi * arange( _NODES ) / _NODES )
+    g0 = 0.5 * theta[...,None] * concatenate( ( cos(phi)[...,None], \
+               sin(phi)[...,None], zeros( phi.shape + (1,) ) ), axis = -1 )
+    if spec['error'] == 'amplitude':
+        g1 = g0
+    else:
+        g1 = zeros( g0.shape )
+        g1[...,2] = 0.5 * theta
+
+    g = g0[:,None] + epsilon[None,:,None,None] * g1[:,None]
+    s = ( g**2 ).sum( axis = -1 )
+    z = sqrt( s + 0j )
+    small = abs(z) < 1E-6
+    S = where( small, 1.0 - s / 6.0, sin(z) / where( small, 1.0, z ) )
+    q = concatenate( ( cos(z)[...,None], S[...,None] * g ), axis = -1 )
+
+    # Multiply the blocks, first to last as written in the template.
+    U = q[:,:,0]
+    for i in range( 1, q.shape[2] ):
+        U = su2.quaternion_product( U, q[:,:,i] )
+    t = spec['target'] * array([ 1, -1, -1, -1 ])
+    E = su2.quaternion_product( t, U )
+
+    order = spec['order']
+    k = arange( order + 1 )
+    c = fft( E, axis = 1 )[:, 0:order+1] / _NODES
+    return real( c / ( _RADIUS ** k )[None,:,None] )
+
+
+def _residuals( x, spec ):
+    # Conditions for error cancellation.  At zero error the sequence
+    # must equal the target up to sign, and the derivatives up to the
+    # requested order must vanish.
+    c = _series( asarray( x, float ).reshape( -1, len(spec['names']) ), spec )
+    return concatenate( ( c[:,0,1:], c[:,1:,:].reshape( len(c), -1 ) ), axis = 1 )
+
+
+def _solve( args ):
+    # Least squares root finding from each starting vector.  The
+    # Jacobian uses central differences evaluated in a single batch.
+    [x0, spec] = args
+    h = 1E-7
+
+    def f( x ):
+        return _residuals( x, spec )[0]
+
+    def jac( x ):
+        P = len(x)
+        X = concatenate( ( x + h * eye(P), x - h * eye(P) ) )
+        r = _residuals( X, spec )
+        return ( r[0:P] - r[P:] ).T / (2*h)
+
+    found = []
+    for x in x0:
+        result = least_squares( f, x, jac = jac, xtol = 1E-15, ftol = 1E-15, \
+                                gtol = 1E-15, method = 'lm' \
+                                if len( f(x) ) >= len(x) else 'trf' )
+        found.append( result.x )
+    return array( found ).reshape( -1, len(spec['names']) )
+
+
+def _deduplicate( x, spec, tol ):
+    # Canonical form for solutions.  Phases are wrapped into
+    # (-pi, pi], and a reflection of all phases is used whenever the
+    # reflected sequence is also a solution.
+    if len(x) == 0:
+        return x
+
+    def wrap( y ):
+        y = y.copy()
+        y[:,spec['phase']] = pi - mod( pi - y[:,spec['phase']], 2*pi )
+        return y
+
+    x = wrap( x )
+    mirror = x.copy()
+    mirror[:,spec['phase']] = - mirror[:,spec['phase']]
+    mirror = wrap( mirror )
+    valid = ( _residuals( mirror, spec )**2 ).sum( axis = 1 ) < tol**2
+
+    # Pick the lexicographically larger of the pair.
+    for i in where( valid )[0]:
+        for (a, b) in zip( x[i], mirror[i] ):
+            if abs( a - b ) > 1E-6:
+                if b > a:
+                    x[i] = mirror[i]
+                break
+
+    key = around( x / 1E-6 ).astype( int )
+    [_, index] = unique( key.view( [('', key.dtype)] * key.shape[1] ), \
+                         return_index = True )
+    x = x[ sorted( index ) ]
+    return x[ argsort( abs( dot( x, abs( spec['theta'] ).T ) ).sum( axis = 1 ), \
+                       kind = 'mergesort' ) ]
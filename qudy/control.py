@@ -20,12 +20,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from quantop import *
-from numpy import all, diff, interp
+from numpy import all, diff, interp, asarray, searchsorted, where
 import plot as qudyplot
 
 __all__ = ['control','load','save']
 
-class control:
+class control( object ):
     """
     class for quantum control functions.  
     
@@ -77,6 +77,11 @@ class control:
           3.  'linear' : use linear interpolation between values
        
        verbose = 'bool' : Boolean flag sets verbosity of outputs.
+
+       copy = 'bool' : Writable input arrays are copied, so that later
+       changes made by the caller do not reach the control.  When
+       False the arrays are handed over to the control and are made
+       read-only in place.  The default is True.
           
     **Raises:**
        
@@ -86,11 +91,36 @@ class control:
     Control objects have several important properties, for instance they may be
     called as functions.  Interpolation is used to estimate the value of the 
     controls at any instant of time within the time interval.
+
+    The arrays ``control`` and ``times`` are read-only, so control
+    instances may share them freely.  Assigning a new array to either
+    attribute replaces it, and writable arrays are copied on
+    assignment.  To modify the values, work on a copy of the array,
+    e.g. ``arr = ctrl.control.copy()``.
     """
+
+    # Read-only array attributes, see _readonly().
+    def _get_control( self ):
+        return self._control
+
+    def _set_control( self, arr ):
+        self._control = _readonly( arr )
+
+    def _get_times( self ):
+        return self._times
+
+    def _set_times( self, arr ):
+        self._times = _readonly( arr )
+
+    control = property( _get_control, _set_control )
+    times = property( _get_times, _set_times )
+
     
     def __init__( self, *args, **keyword_args ):
         """Initialize the control instance."""
         
+        copy_arrays = keyword_args.get( 'copy', True )
+
         # If there is more than one argument, then the last must be an
         # array of time values, e.g. t_arr.
         if len( args ) > 1:
@@ -99,37 +129,30 @@ class control:
             t_arr = args[ len(args) - 1 ]
             try:
                 t_arr = t_arr.__array__()
-                self.times = t_arr.flatten()
-                self.times.shape = (len(self.times),1)
-                # self.timemax = t_arr.max()
-                # self.timemin = t_arr.min()
+                self.times = _readonly( t_arr.reshape( (t_arr.size,1) ), \
+                                        copy = copy_arrays )
                 
             except AttributeError:
                 raise TypeError('Time values must be an array type.')
 
-            ARR = copy( self.times )
-            for index in range( len(args) - 1 ):
-                
-                # Loop over arguments from last to first.  Easist to
-                # keep time vector in the correct position on ARR.
-                arg = args[-(index + 2)]
+            columns = []
+            for arg in args[0:len(args) - 1]:
                 
                 # Is arg a function? Map to a discrete array.
                 if hasattr( arg, '__call__' ):
                     arr = array( map( arg , self.times ) )
-                    arr.shape = (len(self.times),1)
-                    ARR = hstack(( arr , ARR ))
+                    columns.append( arr.reshape( (len(self.times),1) ) )
                     
                 # Is arg an array? Check that it is of proper length.
                 elif hasattr( arg , '__array__' ):
-                    arr = arg
+                    arr = arg.__array__()
                     
                     # Orient arrays in the correct direction
                     if len( arr.shape ) == 1:
-                        arr.shape = ( len(arr) , 1 )
+                        arr = arr.reshape( (len(arr),1) )
                     
                     if arr.shape[0] == len(self.times):
-                        ARR = hstack(( arr , ARR ))
+                        columns.append( arr )
                         
                     else:
                         raise ValueError('Dimension mismatch.')
@@ -139,11 +162,22 @@ class control:
                     raise TypeError('The following argument was not ' + \
                           'understood: \n\n%s\n' %( str(arg) ))
                  
+            # A single read-only array is shared, otherwise the
+            # columns are joined into a new array.  Control values
+            # are floating point.
+            if len( columns ) == 1:
+                ARR = _readonly( columns[0], copy = copy_arrays )
+            else:
+                ARR = _readonly( hstack( columns ), copy = False )
+
+            if not ARR.dtype.kind in 'fc':
+                ARR = _readonly( ARR.astype( float ), copy = False )
+
             # Count number of controls
-            number_controls = ARR.shape[1] - 1
+            number_controls = ARR.shape[1]
             
             # Save relevant data to self
-            self.control = ARR[:, 0:number_controls]
+            self.control = ARR
             self.number_controls = number_controls
             self.dimension = number_controls
                     
@@ -158,9 +192,7 @@ class control:
                 number_controls = ARR.shape[1] - 1
                 
                 # Grab time vector (last column).
-                self.times = ARR[: , number_controls]
-                # self.timemax = max( self.times )
-                # self.timemin = min( self.times )
+                self.times = ARR[: , number_controls].reshape( (len(ARR),1) )
                 
                 # Assign remaining controls.
                 self.control = ARR[: , 0:(number_controls)]
@@ -170,9 +202,6 @@ class control:
             except AttributeError:
                 raise TypeError('Input is of an improper type.')
             
-        # Fix shape of time array
-        self.times.shape = ( len(self.times) , 1 )
-                
         # Sanity checks: see that times is increasing
         if not all( diff( self.times ) > 0 ):
             raise ValueError('Time array is not time-ordered.')
@@ -266,14 +295,11 @@ class control:
     
     def copy(self):
         """
-        Creates an independent copy of self in memory.
+        Creates an independent copy of self in memory.  The read-only
+        arrays are shared with self.
         """
-        
-        ctrl = self.control.copy()
-        times = self.times.copy()
-        c = control( ctrl, times )
-        c.interpolation = str( copy( self.interpolation ) )
-        c.verbose =  bool( copy( self.verbose ) )
+        c = object.__new__( self.__class__ )
+        c.__dict__.update( self.__dict__ )
         
         return c
 
@@ -317,8 +343,8 @@ class control:
         # Make a copy of self to work with.  Flip the time ordering
         # and invert the control components.
         c = self.copy()
-        c.control = - flipud( c.control )
-        c.times = c.timemax() - flipud( c.times )
+        c.control = _readonly( - flipud( c.control ), copy = False )
+        c.times = _readonly( c.timemax() - flipud( c.times ), copy = False )
         
         return c
         
@@ -423,8 +449,65 @@ class control:
                 
         else:
             raise ValueError('Interpolation method not recognized.')
-        
-        
+
+
+    def sample( self, times, interpolation = None ):
+        """
+        Vectorized form of ``interpolate()``.  The controls are
+        evaluated at an array of times with a single call, which is
+        used by the integrators to find the controls at the interior
+        points of each time slice.
+
+        **Args:**
+
+           * *times* : An array of m-many times within the sampling
+             interval.
+
+        **Optional Keys:**
+
+           * interpolation = 'method' : Interpolation method, as in
+             ``interpolate()``.  The default is ``self.interpolation``.
+
+        **Raises:**
+
+           * ``ValueError`` : a time is not within sampling interval.
+           * ``ValueError`` : interpolation method not recognized.
+
+        **Returns:**
+
+           * values : An (m, k) array of control values.
+        """
+        if interpolation == None:
+            interpolation = self.interpolation
+
+        s = asarray( times, float ).flatten()
+        t = asarray( self.times, float ).flatten()
+        if len( s ) and ( s.min() < t[0] or s.max() > t[-1] ):
+            raise ValueError('Interpolation time must lie within the' + \
+                  ' interval ( %.2E , %.2E ).' %(self.timemin(),self.timemax()) )
+
+        # Index of the last sample before each time, as in
+        # interpolate().
+        low = ( searchsorted( t, s ) - 1 ).clip( 0, len(t) - 1 )
+        high = ( low + 1 ).clip( 0, len(t) - 1 )
+
+        if interpolation == 'latest':
+            return asarray( self.control[low,:] )
+
+        elif interpolation == 'nearest':
+            later = ( s - t[low] ) > ( t[high] - s )
+            return asarray( self.control[ where( later, high, low ), : ] )
+
+        elif interpolation == 'linear':
+            y = asarray( self.control )
+            return array( [ interp( s, t, y[:,index] ) \
+                            for index in range( self.number_controls ) ] \
+                          ).T.reshape( (len(s), self.number_controls) )
+
+        else:
+            raise ValueError('Interpolation method not recognized.')
+
+
     def plot( self ):
         """
         Plots the control functions.  The plotting functionality
@@ -579,6 +662,17 @@ class control:
         del numpy
 
 
+def _readonly( arr, copy = True ):
+    # Read-only version of an array.  Arrays that are already read-only
+    # are shared, other arrays are copied unless copy is False.
+    arr = asarray( arr )
+    if arr.flags.writeable:
+        if copy:
+            arr = arr.copy()
+        arr.flags.writeable = False
+    return arr
+
+
 def load( filename, format = None ):
     """A function to load saved control instances"""
     
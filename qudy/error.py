@@ -22,9 +22,9 @@
 from quantop import *
 from control import control
 
-__all__ = ['error']
+__all__ = ['error','composite_error']
 
-class error:
+class error( object ):
     """
     class for quantum control error models.
     
@@ -46,6 +46,12 @@ class error:
          by the error model.  When the parameters are not provided,
          the model uses a default set. Check the error model's
          specific documentation for more details.
+
+    **Optional keys:**
+
+       Keywords are passed on to the error model.  For instance
+       ``error( 'bandwidth', [0.1], filter = 'rc' )`` selects the
+       impulse response of the bandwidth model.
     
     Once constructed, an error model acts as a functional: taking an
     input control and returning an output (distorted) control.  
@@ -117,6 +123,7 @@ class error:
         # Save the error parameters
         self.default_parameters = self.model.default_parameters()
         self.error_parameters = error_parameters
+        self.keyword_args = keyword_args
         
         
     def __call__( self, ctrl ):
@@ -124,9 +131,73 @@ class error:
         Implements functional behavior.  Inputs a control instance and
         returns a distorted control function.
         """
-        return self.model.call( ctrl, self.error_parameters )
+        return self.model.call( ctrl, self.error_parameters, **self.keyword_args )
     
     
+    def transform( self, arr, times ):
+        """
+        Applies the error model directly to a control array, without
+        constructing control instances.
+
+        **Args:**
+
+           * *arr* : An (n, k) array of control values.
+           * *times* : An (n, 1) array of time values.
+
+        **Returns:**
+
+           * [arr, times] : The distorted control values and their
+             time values.
+        """
+        try:
+            transform = self.model.transform
+
+        except AttributeError:
+            # Model only acts on control instances.
+            ctrl = self.model.call( control( arr, times ), \
+                                    self.error_parameters, **self.keyword_args )
+            return [ctrl.control, ctrl.times]
+
+        return transform( arr, times, self.error_parameters, **self.keyword_args )
+
+
+    def pullback( self, ctrl, gradient ):
+        """
+        Maps a gradient taken with respect to the distorted control
+        values back onto the ideal control values.  Used by gradient
+        based optimizers.
+
+        **Args:**
+
+           * *ctrl* : The ideal control instance.
+           * *gradient* : An array with the shape of the distorted
+             control array.
+
+        **Raises:**
+
+           * ``NotImplementedError`` : The error model does not define
+             a pullback.
+
+        **Returns:**
+
+           * An array with the shape of ``ctrl.control``.
+        """
+        return self._pullback( ctrl.control, ctrl.times, gradient )
+
+
+    def _pullback( self, arr, times, gradient ):
+        # Array level pullback, see pullback().
+        try:
+            pullback = self.model.pullback
+
+        except AttributeError:
+            raise NotImplementedError('Error model %s does not define ' \
+                                      %(self.model_name) + 'a pullback.')
+
+        return pullback( arr, times, gradient, self.error_parameters, \
+                         **self.keyword_args )
+
+
     def __repr__( self ):
         """
         Function to display error objects when called on the command line.
@@ -153,4 +224,131 @@ class error:
         """
         Function to make copy of self in memory.
         """
-        return error( self.model_name, self.error_parameters )
+        return error( self.model_name, self.error_parameters, **self.keyword_args )
+
+
+class composite_error( error ):
+    """
+    class for chains of error models.  The models are applied in
+    order, as one transformation of the control array, so that no
+    intermediate control instances are formed.
+
+    **Forms:**
+
+       * ``composite_error( err_1, err_2, ... )``
+
+    **Args:**
+
+       * *err* : An error object, or the name of an error model.
+
+    The parameters of all models are joined into a single list,
+    ``error_parameters``, so that sweeps and quadrature run over the
+    joint error space.  Assigning a list of one element sets every
+    parameter to that value.
+
+    .. code-block:: python
+
+       # Amplitude error, then a detuning
+       err = composite_error( error('amplitude',[0.01]), \
+                              error('detuning',[0.02]) )
+       err.error_parameters = [0.02, 0.01]
+       v = err( u )
+    """
+    def __init__( self, *errors ):
+        """
+        Initialize a composite_error instance.
+        """
+        if len( errors ) == 0:
+            raise ValueError('A composite requires at least one error model.')
+
+        self.errors = []
+        for err in errors:
+            if isinstance( err, error ):
+                self.errors.append( err )
+            else:
+                self.errors.append( error( err ) )
+
+        self.model_name = 'composite'
+        self.keyword_args = {}
+        self.default_parameters = []
+        for err in self.errors:
+            self.default_parameters = self.default_parameters + \
+                                      list( err.default_parameters )
+
+
+    def _get_parameters( self ):
+        # Joint parameter vector.
+        parameters = []
+        for err in self.errors:
+            parameters = parameters + list( err.error_parameters )
+        return parameters
+
+
+    def _set_parameters( self, parameters ):
+        # Split a joint parameter vector between the models.
+        try:
+            parameters = list( parameters )
+        except TypeError:
+            parameters = [ float( parameters ) ]
+
+        sizes = [ len( err.error_parameters ) for err in self.errors ]
+        if len( parameters ) == 1:
+            parameters = parameters * sum( sizes )
+
+        if not len( parameters ) == sum( sizes ):
+            raise ValueError('Composite error requires %i parameters.' \
+                             %( sum( sizes ) ))
+
+        start = 0
+        for (err, size) in zip( self.errors, sizes ):
+            err.error_parameters = parameters[start:start+size]
+            start = start + size
+
+    error_parameters = property( _get_parameters, _set_parameters )
+
+
+    def __call__( self, ctrl ):
+        """
+        Implements functional behavior.  Inputs a control instance and
+        returns a distorted control function.
+        """
+        [arr, times] = self.transform( ctrl.control, ctrl.times )
+        return control( arr, times, copy = False )
+
+
+    def transform( self, arr, times ):
+        """
+        Applies every model in turn to a control array.  See
+        ``error.transform()``.
+        """
+        for err in self.errors:
+            [arr, times] = err.transform( arr, times )
+        return [arr, times]
+
+
+    def _pullback( self, arr, times, gradient ):
+        # Record the arrays entering each model, then pull the
+        # gradient back through the models in reverse order.
+        stages = []
+        for err in self.errors:
+            stages.append( (arr, times) )
+            [arr, times] = err.transform( arr, times )
+
+        for (err, (arr, times)) in reversed( zip( self.errors, stages ) ):
+            gradient = err._pullback( arr, times, gradient )
+        return gradient
+
+
+    def __repr__( self ):
+        """
+        Function to display composite_error objects when called on the
+        command line.
+        """
+        return '\n'.join( [ repr( err ) for err in self.errors ] )
+
+
+    def copy( self ):
+        """
+        Function to make copy of self in memory.
+        """
+        return composite_error( *[ err.copy() for err in self.errors ] )
@@ -11,6 +11,7 @@ from ..control import control
 from addressing import *
 from amplitude import *
 from amplitude_damping import *
+from bandwidth import *
 from depolarization import *
 from detuning import *
 from pink_noise import *
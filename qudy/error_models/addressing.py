@@ -12,6 +12,19 @@ def call( ctrl, error_parameters, **keyword_args ):
     #if error_parameters == None:
     #    error_parameters = default_parameters()
       
+    # Transform the control arrays.
+    [arr, t] = transform( ctrl.control, ctrl.times, error_parameters )
+
+    # Return modified control.
+    return control( arr, t, copy = False )
+
+
+def transform( arr, times, error_parameters, **keyword_args ):
+    """
+    Applies the addressing error to a control array.  Returns the
+    distorted array and its time values.
+    """
+
     # Perhaps the user was lasy any input the error parameters as a
     # single element rather than a subscriptable list.  Fix.
     try:
@@ -20,13 +33,22 @@ def call( ctrl, error_parameters, **keyword_args ):
         epsilon = error_parameters
     
     # Update amplitude of control values
-    arr = epsilon * ctrl.control
-    t = ctrl.times
-
-    # Return modified control
-    return control(arr,t)
+    return [epsilon * arr, times]
    
  
+def pullback( arr, times, gradient, error_parameters, **keyword_args ):
+    """
+    Gradient with respect to the ideal controls.  The model is a
+    uniform scaling, so the gradient is scaled by the same factor.
+    """
+    try:
+        epsilon = error_parameters[0]
+    except TypeError:
+        epsilon = error_parameters
+
+    return epsilon * gradient
+
+
 def default_parameters():
     """
     default parameters
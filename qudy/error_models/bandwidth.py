@@ -0,0 +1,221 @@
+# BANDWIDTH.PY
+#
+# Bandwidth limit (transfer function) error model
+#
+# Copyright (C) 2011, 2012 True Merrill
+# Georgia Institute of Technology
+# School of Chemistry and Biochemistry
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from numpy import asarray, arange, zeros, exp, ceil, diff, allclose, \
+     linspace, searchsorted, clip, interp, loadtxt, conj, add
+from numpy.fft import rfft, irfft
+from ..control import control
+
+
+def call( ctrl, error_parameters, **keyword_args ):
+    """
+    Method for the bandwidth error model.  Each control function is
+    convolved with the impulse response of a low-pass filter.
+
+    **Optional keys:**
+
+       * filter = 'type' : The impulse response.
+
+          1.  'gaussian' : Zero-phase Gaussian filter.  The error
+              parameter is the standard deviation of the kernel.
+          2.  'rc' : Causal RC filter.  The error parameter is the
+              time constant.
+          3.  filename : A measured kernel, read from a text file of
+              (time, response) pairs.  The error parameter stretches
+              the time axis of the kernel, with 1.0 meaning as measured.
+
+       * oversample = n : The controls are held constant over each
+         time slice and resampled onto a uniform grid n times finer
+         than the shortest slice before filtering.  The default is 1.
+
+    The control is assumed to vanish outside of its time interval.
+    Kernels are normalized to unit gain at zero frequency.
+    """
+    # Transform the control arrays.
+    [arr, t] = transform( ctrl.control, ctrl.times, error_parameters, \
+                          **keyword_args )
+
+    # Return modified control.
+    return control( arr, t, copy = False )
+
+
+def transform( arr, times, error_parameters, **keyword_args ):
+    """
+    Applies the bandwidth error to a control array.  Returns the
+    filtered array and the resampled time values.
+    """
+    try:
+        tau = error_parameters[0]
+    except TypeError:
+        tau = error_parameters
+
+    [t, index] = _grid( times, keyword_args )
+    return [_filter( arr, t, index, [tau], keyword_args )[0], t]
+
+
+def batch( ctrl, parameters, **keyword_args ):
+    """
+    Filters a control for several values of the error parameter at
+    once.  The control is transformed once, and each filter costs a
+    single product with its transfer function.
+
+    **Args:**
+
+       * *ctrl* : An instance of the control class.
+       * *parameters* : A list of B error parameters.
+
+    **Returns:**
+
+       * arr : A (B, n, k) array of filtered controls on the resampled
+         time grid.
+    """
+    [t, index] = _grid( ctrl.times, keyword_args )
+    return _filter( ctrl.control, t, index, parameters, keyword_args )
+
+
+def pullback( arr, times, gradient, error_parameters, **keyword_args ):
+    """
+    Gradient with respect to the ideal controls.  The transpose of a
+    convolution is a correlation with the same kernel, followed by
+    summing the resampled points back onto their time slices.
+    """
+    try:
+        tau = error_parameters[0]
+    except TypeError:
+        tau = error_parameters
+
+    [t, index] = _grid( times, keyword_args )
+    g = asarray( gradient, float )
+    dt = t[1] - t[0]
+
+    [h, offset] = _kernels( [tau], dt, keyword_args )
+    N = _size( len(t) + h.shape[1] - 1 )
+    gz = zeros( (offset + len(t), g.shape[1]) )
+    gz[offset:] = g
+    G = irfft( conj( rfft( h[0], N ) )[:,None] * rfft( gz, N, axis = 0 ), \
+               N, axis = 0 )[0:len(t)]
+
+    grad = zeros( arr.shape )
+    add.at( grad, index, G )
+    return grad
+
+
+def default_parameters():
+    """
+    Default parameters.
+    """
+
+    return [0.1]
+
+
+def repr( error_parameters ):
+    """
+    Function to display bandwidth objects when called on the command line
+    """
+
+    string = "bandwidth error: \n" + \
+             "    tau:\t%.2E" %( error_parameters[0] )
+    return string
+
+
+def _grid( times, keyword_args ):
+    # Uniform time grid used for filtering, and the index of the
+    # control sample that holds on each grid point.
+    times = asarray( times ).flatten()
+    oversample = keyword_args.get( 'oversample', 1 )
+    dt = diff( times )
+
+    if oversample == 1 and allclose( dt, dt[0], rtol = 1E-6, atol = 0 ):
+        return [times, arange( len(times) )]
+
+    N = int( ceil( ( times[-1] - times[0] ) / dt.min() * oversample - 1E-9 ) )
+    t = linspace( times[0], times[-1], N + 1 )
+    index = clip( searchsorted( times, t, 'right' ) - 1, 0, len(times) - 1 )
+    return [t, index]
+
+
+def _filter( arr, t, index, parameters, keyword_args ):
+    # Hold the controls on the uniform grid t and convolve with the
+    # kernel of each parameter.
+    u = asarray( arr, float )[index]
+    dt = t[1] - t[0]
+
+    [h, offset] = _kernels( parameters, dt, keyword_args )
+    N = _size( len(t) + h.shape[1] - 1 )
+    Y = irfft( rfft( h, N, axis = 1 )[:,:,None] * rfft( u, N, axis = 0 )[None], \
+               N, axis = 1 )
+
+    return Y[:, offset:offset + len(t), :]
+
+
+def _kernels( parameters, dt, keyword_args ):
+    # Sampled impulse responses, one row per parameter.  offset is the
+    # position of zero delay within each row.
+    kind = keyword_args.get( 'filter', 'gaussian' )
+    parameters = [ max( float(p), 0.0 ) for p in parameters ]
+
+    if kind == 'gaussian':
+        J = int( ceil( 4 * max( parameters ) / dt ) )
+        s = dt * arange( -J, J + 1 )
+        h = zeros( (len(parameters), len(s)) )
+        for (i, tau) in enumerate( parameters ):
+            if tau == 0:
+                h[i, J] = 1.0
+            else:
+                h[i] = exp( - s**2 / ( 2 * tau**2 ) )
+        offset = J
+
+    elif kind == 'rc':
+        J = int( ceil( 10 * max( parameters ) / dt ) )
+        s = dt * arange( J + 1 )
+        h = zeros( (len(parameters), len(s)) )
+        for (i, tau) in enumerate( parameters ):
+            if tau == 0:
+                h[i, 0] = 1.0
+            else:
+                h[i] = exp( - s / tau )
+        offset = 0
+
+    else:
+        # Measured kernel.  Stretch the time axis by each parameter and
+        # resample onto the filtering grid.
+        data = loadtxt( kind, ndmin = 2 )
+        [s0, r0] = [ data[:,0], data[:,-1] ]
+        lo = max( int( ceil( -s0[0] * max( parameters ) / dt ) ), 0 )
+        hi = max( int( ceil( s0[-1] * max( parameters ) / dt ) ), 0 )
+        s = dt * arange( -lo, hi + 1 )
+        h = zeros( (len(parameters), len(s)) )
+        for (i, scale) in enumerate( parameters ):
+            if scale == 0:
+                h[i, lo] = 1.0
+            else:
+                h[i] = interp( s / scale, s0, r0, left = 0, right = 0 )
+        offset = lo
+
+    return [h / h.sum( axis = 1 )[:,None], offset]
+
+
+def _size( n ):
+    # Smallest power of two not less than n.
+    N = 1
+    while N < n:
+        N = 2 * N
+    return N
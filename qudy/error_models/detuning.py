@@ -30,6 +30,19 @@ def call( ctrl, error_parameters, **keyword_args ):
     if error_parameters == None:
         error_parameters = default_parameters()
       
+    # Transform the control arrays.
+    [arr, t] = transform( ctrl.control, ctrl.times, error_parameters )
+
+    # Return modified control.
+    return control( arr, t, copy = False )
+
+
+def transform( arr, times, error_parameters, **keyword_args ):
+    """
+    Applies the detuning error to a control array.  Returns the
+    distorted array and its time values.
+    """
+
     # Perhaps the user was lasy any input the error parameters as a
     # single element rather than a subscriptable list.  Fix.
     try:
@@ -38,13 +51,21 @@ def call( ctrl, error_parameters, **keyword_args ):
         delta = error_parameters
     
     # Update control values.  Detuning error induces a shift in the Z
-    # direction by a strength delta = detuning.
-    arr = ctrl.control
+    # direction by a strength delta = detuning.  Work on a copy so the
+    # input array is left untouched.
+    arr = arr.copy()
     arr[:,2] = delta
-    t = ctrl.times
+    return [arr, times]
 
-    # Return modified control.
-    return control(arr,t)
+
+def pullback( arr, times, gradient, error_parameters, **keyword_args ):
+    """
+    Gradient with respect to the ideal controls.  The Z control is
+    replaced by the detuning, so its gradient vanishes.
+    """
+    grad = gradient.copy()
+    grad[:,2] = 0
+    return grad
 
 
 def default_parameters():
@@ -0,0 +1,377 @@
+# HAMILTONIAN_SET.PY
+#
+# An immutable stack of control Hamiltonians
+#
+# Copyright (C) 2011, 2012 True Merrill
+# Georgia Institute of Technology
+# School of Chemistry and Biochemistry
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from quantop import *
+from numpy import asarray, ascontiguousarray, einsum, matmul, count_nonzero, \
+     searchsorted, repeat, diff, int64
+from numpy.linalg import eigh as _eigh
+from scipy.sparse import csr_matrix, issparse
+from scipy.sparse.csgraph import connected_components
+from hashlib import sha1
+import pauli
+import local_operator
+
+__all__ = ['hamiltonian_set']
+
+
+class hamiltonian_set( object ):
+    """
+    class for the Hamiltonians of a bilinear control system.  The
+    Hamiltonians are stored as one contiguous, read-only (k, N, N)
+    array.  Instances are immutable and hashable, so that derived
+    data may be computed once and shared between propagators.
+
+    **Forms:**
+
+       * ``hamiltonian_set( hamiltonians )``
+       * ``hamiltonian_set( hamiltonians, sparse = True )``
+
+    **Args:**
+
+       * *hamiltonians* : A list or array of k-many N x N
+         Hamiltonians, a list of pauli strings or local operators, or
+         another hamiltonian_set instance.  Instances share their array and
+         their cached data.
+
+    **Optional keys:**
+
+       * sparse = bool : If True, the Hamiltonians are stored as a
+         list of scipy.sparse CSR matrices in ``self.matrices``, and
+         ``self.array`` is None.  By default the set is sparse when
+         any of the Hamiltonians is a scipy.sparse matrix, a pauli
+         string or a local operator.  Sparse sets are meant for
+         large registers, see ``integration.evolve()``.
+
+    A hamiltonian_set behaves as a sequence of operators, so it may be
+    used wherever a list of Hamiltonians is accepted.  Each element is
+    a read-only view into the stack, or a read-only CSR matrix.
+
+    Two sets are equal when their fingerprints are equal.  The
+    fingerprint is a SHA-1 digest of the array, computed once on
+    construction, so comparisons and hashing cost O(1).  The
+    properties ``commuting``, ``hermitian``, ``diagonal``,
+    ``sparsity``, ``blocks`` and ``eigenbasis`` are computed on first
+    use and cached.
+    """
+
+    def __init__( self, hamiltonians, sparse = None ):
+        """Initialize the hamiltonian_set instance."""
+
+        if isinstance( hamiltonians, hamiltonian_set ):
+            if sparse is None or sparse == hamiltonians.sparse:
+                # Share the array and the cache of the other instance.
+                self.__dict__.update( hamiltonians.__dict__ )
+                return
+
+        hamiltonians = list( hamiltonians )
+        if sparse is None:
+            sparse = any( [ _sparse_input( h ) for h in hamiltonians ] )
+
+        self.sparse = bool( sparse )
+        self._cache = {}
+
+        if self.sparse:
+            self.array = None
+            self.matrices = [ _csr( h ) for h in hamiltonians ]
+            shapes = set( [ h.shape for h in self.matrices ] )
+            if not ( len( shapes ) == 1 and \
+                     self.matrices[0].shape[0] == self.matrices[0].shape[1] ):
+                raise ValueError('Hamiltonians must be square matrices of ' + \
+                                 'the same dimensionality.')
+
+            digest = sha1( 'sparse' + str( self.matrices[0].shape ) )
+            for h in self.matrices:
+                for a in [h.indptr, h.indices, h.data]:
+                    digest.update( a.tostring() )
+            self.fingerprint = digest.hexdigest()
+            return
+
+        arr = ascontiguousarray( [ _dense( h ) for h in hamiltonians ] )
+        if not ( arr.ndim == 3 and arr.shape[1] == arr.shape[2] ):
+            raise ValueError('Hamiltonians must be square matrices of ' + \
+                             'the same dimensionality.')
+        arr.flags.writeable = False
+
+        self.array = arr
+        self.fingerprint = sha1( str( arr.shape ) + arr.tostring() ).hexdigest()
+
+
+    def __repr__( self ):
+        """
+        Function to display hamiltonian_set objects when called on the
+        command line.
+        """
+        return '%i Hamiltonians on a %i-D space, %s' %( len( self ), \
+               self.dimension, self.fingerprint[0:8] )
+
+
+    def __len__( self ):
+        if self.sparse:
+            return len( self.matrices )
+        return self.array.shape[0]
+
+
+    def __getitem__( self, index ):
+        if self.sparse:
+            if isinstance( index, slice ):
+                return hamiltonian_set( self.matrices[index], sparse = True )
+            return self.matrices[index]
+
+        if isinstance( index, slice ):
+            return hamiltonian_set( self.array[index] )
+        return self.array[index].view( operator )
+
+
+    def __iter__( self ):
+        for index in range( len( self ) ):
+            yield self[index]
+
+
+    def __array__( self, dtype = None ):
+        if self.sparse:
+            arr = asarray( [ h.toarray() for h in self.matrices ] )
+        else:
+            arr = self.array
+        if dtype is None:
+            return arr
+        return arr.astype( dtype )
+
+
+    def __hash__( self ):
+        return hash( self.fingerprint )
+
+
+    def __eq__( self, other ):
+        if not isinstance( other, hamiltonian_set ):
+            try:
+                other = hamiltonian_set( other )
+            except (ValueError, TypeError):
+                return False
+        return self.fingerprint == other.fingerprint
+
+
+    def __ne__( self, other ):
+        return not self == other
+
+
+    def copy( self ):
+        """
+        Instances are immutable, so copies share memory with self.
+        """
+        return hamiltonian_set( self )
+
+
+    @property
+    def dimension( self ):
+        """
+        Dimensionality N of the Hilbert space.
+        """
+        if self.sparse:
+            return self.matrices[0].shape[0]
+        return self.array.shape[1]
+
+
+    @property
+    def commuting( self ):
+        """
+        True when every pair of Hamiltonians commutes.  The pairs are
+        checked one Hamiltonian at a time, against all of the earlier
+        ones, and the check stops at the first pair which fails.  The
+        commutator of a pair is compared with the product of their
+        Frobenius norms.
+        """
+        if not 'commuting' in self._cache:
+            value = True
+            if self.sparse:
+                H = self.matrices
+                scale = [ sqrt( ( abs( h.data )**2 ).sum() ) for h in H ]
+                for a in range( len(H) ):
+                    for b in range( a ):
+                        r = abs( ( H[a] * H[b] - H[b] * H[a] ).data )
+                        if len(r) and r.max() > 1E-12 * scale[a] * scale[b]:
+                            value = False
+                            break
+                    if not value:
+                        break
+            else:
+                H = self.array
+                scale = sqrt( ( abs( H )**2 ).sum( axis = 2 ).sum( axis = 1 ) )
+                for a in range( 1, len(H) ):
+                    C = matmul( H[a], H[:a] ) - matmul( H[:a], H[a] )
+                    r = abs( C ).max( axis = 2 ).max( axis = 1 )
+                    if ( r > 1E-12 * scale[a] * scale[:a] ).any():
+                        value = False
+                        break
+            self._cache['commuting'] = value
+        return self._cache['commuting']
+
+
+    @property
+    def hermitian( self ):
+        """
+        True when every Hamiltonian is Hermitian, relative to its
+        Frobenius norm.
+        """
+        if not 'hermitian' in self._cache:
+            if self.sparse:
+                H = self.matrices
+                value = True
+                for h in H:
+                    r = abs( ( h - h.conj().T ).data )
+                    scale = sqrt( ( abs( h.data )**2 ).sum() )
+                    if len(r) and r.max() > 1E-12 * scale:
+                        value = False
+                        break
+            else:
+                H = self.array
+                scale = sqrt( ( abs( H )**2 ).sum( axis = 2 ).sum( axis = 1 ) )
+                value = True
+                for a in range( len(H) ):
+                    r = abs( H[a] - H[a].conj().T ).max()
+                    if r > 1E-12 * scale[a]:
+                        value = False
+                        break
+            self._cache['hermitian'] = value
+        return self._cache['hermitian']
+
+
+    @property
+    def diagonal( self ):
+        """
+        True when every Hamiltonian is diagonal.
+        """
+        if not 'diagonal' in self._cache:
+            if self.sparse:
+                self._cache['diagonal'] = all( [ ( h.indices == _rows( h ) ).all() \
+                                                 for h in self.matrices ] )
+            else:
+                H = self.array
+                D = einsum( 'kii->ki', H )
+                self._cache['diagonal'] = count_nonzero( H ) == count_nonzero( D )
+        return self._cache['diagonal']
+
+
+    @property
+    def sparsity( self ):
+        """
+        Fraction of the matrix elements which vanish.
+        """
+        if not 'sparsity' in self._cache:
+            if self.sparse:
+                nnz = sum( [ h.nnz for h in self.matrices ] )
+            else:
+                nnz = count_nonzero( self.array )
+            size = len( self ) * self.dimension**2
+            self._cache['sparsity'] = 1.0 - nnz / float( max( size, 1 ) )
+        return self._cache['sparsity']
+
+
+    @property
+    def blocks( self ):
+        """
+        Common block structure of the Hamiltonians.  A list of index
+        arrays, one for each block, such that every Hamiltonian is
+        block diagonal after the basis states are grouped by block.
+        The blocks are the connected components of the graph whose
+        edges are the nonzero matrix elements of any Hamiltonian.
+        """
+        if not 'blocks' in self._cache:
+            pattern = abs( self.pattern[0] )
+            [m, labels] = connected_components( pattern, directed = False )
+            self._cache['blocks'] = [ ( labels == b ).nonzero()[0] \
+                                      for b in range( m ) ]
+        return self._cache['blocks']
+
+
+    @property
+    def pattern( self ):
+        """
+        The Hamiltonians on the union of their sparsity patterns.  A
+        list [P, D], where P is a CSR matrix with the common pattern
+        and D is a (k, nnz) array with the elements of each
+        Hamiltonian on that pattern.  The data of the linear
+        combination :math:`\\sum_\\mu u_\\mu H_\\mu` is ``dot( u,
+        D )``, so it may be formed without sparse additions.
+        """
+        if not 'pattern' in self._cache:
+            H = self.matrices if self.sparse else \
+                [ _csr( h ) for h in self.array ]
+            N = self.dimension
+            P = _csr( sum( [ abs( h ) for h in H ], csr_matrix( (N,N) ) ) )
+            index = _rows( P ) * N + P.indices
+            D = zeros( (len(H), P.nnz), complex )
+            for (k, h) in enumerate( H ):
+                D[k, searchsorted( index, _rows( h ) * N + h.indices )] = h.data
+            P.data = ones( P.nnz, complex )
+            D.flags.writeable = False
+            self._cache['pattern'] = [P, D]
+        return self._cache['pattern']
+
+
+    @property
+    def eigenbasis( self ):
+        """
+        Eigendecompositions of the Hamiltonians, found with one
+        batched call.  A list [w, V] where w is a (k, N) array of
+        eigenvalues and V is a (k, N, N) array whose columns are the
+        eigenvectors, :math:`H_\\mu = V_\\mu \\, \\mathrm{diag}( w_\\mu
+        ) V_\\mu^\\dagger`.
+        """
+        if not 'eigenbasis' in self._cache:
+            if self.sparse:
+                raise ValueError('Eigenbases are only found for dense sets.')
+            [w, V] = _eigh( self.array )
+            w.flags.writeable = False
+            V.flags.writeable = False
+            self._cache['eigenbasis'] = [w, V]
+        return self._cache['eigenbasis']
+
+
+def _dense( h ):
+    # Dense matrix of a Hamiltonian.
+    if issparse( h ):
+        return h.toarray().astype( complex )
+    return asarray( h, complex )
+
+
+def _sparse_input( h ):
+    # Hamiltonians that are stored sparse by default.
+    return issparse( h ) or isinstance( h, pauli.pauli ) or \
+           isinstance( h, local_operator.local_operator )
+
+
+def _csr( h ):
+    # Canonical CSR form of a Hamiltonian, with sorted indices and no
+    # explicit zeros, so that equal matrices have equal fingerprints.
+    if _sparse_input( h ) and not issparse( h ):
+        h = h.sparse()
+    h = csr_matrix( h, dtype = complex, copy = True )
+    h.sum_duplicates()
+    h.eliminate_zeros()
+    h.sort_indices()
+    for a in [h.indptr, h.indices, h.data]:
+        a.flags.writeable = False
+    return h
+
+
+def _rows( h ):
+    # Row index of each stored element of a CSR matrix.
+    return repeat( arange( h.shape[0], dtype = int64 ), diff( h.indptr ) )
@@ -21,7 +21,10 @@
 
 from quantop import *
 from propagator import *
-import error, control
+from numpy import einsum, dot, cumsum, sinc, asarray
+from numpy.linalg import lstsq
+from numpy.polynomial.legendre import leggauss
+import error, control, integration
 
 
 __all__ = ['imperfect','imperfect_rotation','M']
@@ -72,9 +75,6 @@ class imperfect( propagator ):
         
         propagator.__init__( self, *args[0:len(args)-1], **keyword_args )
 
-        # Save an ideal set of controls
-        self.ideal_control = self.control.copy()
-        
         # Update the error
         self.update_error()
         
@@ -99,11 +99,14 @@ class imperfect( propagator ):
         
         # Use propagator __mul__ method, but make the output an
         # imperfect instance and make the error match self.
-        U1 = propagator( self.ideal_control )
-        U2 = propagator( target.ideal_control )
+        U1 = propagator( self.ideal_control, self.hamiltonians, \
+                         drift = self.drift )
+        U2 = propagator( target.ideal_control, target.hamiltonians, \
+                         drift = target.drift )
         U = propagator.__mul__(U1,U2)
         
-        V = imperfect( U.ideal_control , self.hamiltonians, self.error )
+        V = imperfect( U.ideal_control , self.hamiltonians, self.error, \
+                       drift = self.drift )
         return V
     
     
@@ -112,12 +115,13 @@ class imperfect( propagator ):
         Create an independent copy of self in memory.
         """
         ctrl = self.ideal_control.copy()
-        hamiltonians = self.hamiltonians[:]
         error = self.error.copy()
 
-        c = imperfect( ctrl, hamiltonians, error )
+        c = imperfect( ctrl, self.hamiltonians, error, drift = self.drift )
         c.solution_method = str( copy( self.solution_method ) )
         c.order = int( copy( self.order ) )
+        c.tolerance = self.tolerance
+        c.threads = self.threads
         
         return c
     
@@ -131,14 +135,17 @@ class imperfect( propagator ):
         """
         
         # Calculate inverse control
-        ctrl = self.ideal_control.control.copy()
-        inv_ctrl = - flipud( ctrl )
+        ctrl = self.ideal_control.copy()
+        ctrl.control = - flipud( ctrl.control )
         
         # Create copy of self
         c = self.copy()
         
-        # Replace c.control with inverse controls
-        c.ideal_control.control = inv_ctrl
+        # Replace c.control with inverse controls.  A drift is
+        # reversed by changing its sign.
+        c.ideal_control = ctrl
+        if c.drift is not None:
+            c.drift = - c.drift
         c.update_error()
 
         return c
@@ -200,8 +207,204 @@ class imperfect( propagator ):
         picture is an operation on the basis Hamiltonians, which then
         can be mapped onto an image of the control functions
         themselves.
+
+        Let :math:`U(t)` be the ideal propagator.  The toggling frame
+        image of a basis Hamiltonian is expanded in the adjoint
+        representation as :math:`U^\\dagger(t) H_\\mu U(t) = \\sum_\\nu
+        R_{\\mu\\nu}(t) H_\\nu`.  The basis is ``self.hamiltonians``
+        when the Hamiltonians close under commutation, otherwise it is
+        extended by the remaining elements of the dynamical Lie
+        algebra.  The basis is saved to ``self.frame_basis``.
+
+        A drift Hamiltonian is part of the ideal evolution.  If it lies
+        in the span of the Hamiltonians it is added to the ideal
+        controls, otherwise it follows the Hamiltonians in the basis,
+        with a constant control of 1.
+
+        The ideal trajectory is only computed once.  Afterwards
+        ``error_image()`` and ``error_terms()`` may be evaluated for
+        any number of error models at the cost of a few tensor
+        contractions on (k, k) arrays.
+
+        **Returns:**
+
+           * frame : An (n, k, k) array of adjoint representation
+             coefficients, one for each of the n sampled times.
+        """
+
+        # The ideal trajectory in the adjoint representation.  As in
+        # the Trotter solver, the controls are constant over each time
+        # slice.
+        [ctrl, hamiltonians] = self._frame_bilinear()
+        [frame, basis, F] = integration.adjoint( ctrl, hamiltonians, \
+                                                 full_output = True )
+
+        # Save the ideal trajectory.  Everything the error terms need
+        # is kept in orthonormal coordinates.
+        self._frame = F
+        self.frame_basis = [ operator(b) for b in basis ]
+        self.frame = frame
+
+        return self.frame
+
+
+    def error_image( self, err = None ):
+        """
+        Calculates the toggling frame image of the error Hamiltonian.
+        The error Hamiltonian is the difference between the distorted
+        and the ideal control Hamiltonians, :math:`\\delta H(t) =
+        \\sum_\\mu ( v_\\mu(t) - u_\\mu(t) ) H_\\mu`.
+
+        **Forms:**
+
+           * ``error_image()``
+           * ``error_image( err )``
+
+        **Args:**
+
+           * *err* : An error object.  When supplied, the image is
+             computed for this error model instead of ``self.error``.
+             Self is not modified.
+
+        **Returns:**
+
+           * image : An (n-1, k) array.  Row j holds the coefficients
+             of :math:`U^\\dagger \\delta H U` in ``self.frame_basis``
+             at the beginning of the j-th time slice.
         """
-        return NotImplemented
+        if not hasattr( self, 'frame' ):
+            self.interaction_frame()
+
+        delta = self._error_controls( err )
+        return einsum( 'ja,jab->jb', delta, self.frame[:-1] )
+
+
+    def error_terms( self, err = None, order = 2 ):
+        """
+        Calculates the leading terms of the Magnus expansion of the
+        error propagator in the toggling frame.  The distorted
+        propagator is :math:`V = U \\exp( -i ( \\Omega_1 + \\Omega_2 +
+        \\ldots ) )`, where :math:`U` is the ideal propagator.
+
+        **Forms:**
+
+           * ``error_terms()``
+           * ``error_terms( err )``
+           * ``error_terms( err, order = n )``
+
+        **Args:**
+
+           * *err* : An error object.  When supplied, the terms are
+             computed for this error model instead of ``self.error``.
+             Self is not modified.
+
+        **Optional keys:**
+
+           * order = n : Number of terms to calculate, either 1 or 2.
+
+        **Returns:**
+
+           * [Omega1, Omega2] : A list of Hermitian operators.  The
+             integrals are exact for piecewise-constant controls.
+        """
+        if not order in [1, 2]:
+            raise ValueError('Only first and second order terms are supported.')
+
+        if not hasattr( self, 'frame' ):
+            self.interaction_frame()
+
+        F = self._frame
+        dt = F['dt']
+        lam = F['lam']
+        V = F['V']
+        Q = F['Q']
+        
+        # Error coefficients in orthonormal coordinates, decomposed
+        # onto the eigenvectors of each slice generator.
+        delta = dot( self._error_controls( err ), F['Sinv'] )
+        alpha = einsum( 'ja,jap->jp', delta, V )
+        W = einsum( 'jap,jab->jpb', V.conj(), Q[:-1] )
+
+        # First order term.  The integral over each slice is exact.
+        slices = ( einsum( 'jp,jp,jpb->jb', alpha, _phi( lam, dt ), W ) ).real
+        a1 = slices.sum( axis = 0 )
+        terms = [ a1 ]
+
+        if order == 2:
+            
+            # Second order term, M_ab = int dt1 h_a(t1) int^t1 dt2
+            # h_b(t2).  Contributions from earlier slices are exact,
+            # the nested integral within each slice uses Gauss-Legendre
+            # quadrature with enough nodes to resolve its phase.
+            before = vstack( ( zeros( (1, len(a1)) ), \
+                               cumsum( slices, axis = 0 )[:-1] ) )
+            M = einsum( 'ja,jb->ab', slices, before )
+
+            phase = abs( lam * dt[:,None] ).max() if len( dt ) else 0.0
+            [x, wx] = leggauss( int( min( 8 + 2 * ceil( phase ), 128 ) ) )
+            for (x_g, w_g) in zip( x, wx ):
+                s = 0.5 * ( x_g + 1.0 ) * dt
+                h = einsum( 'jp,jp,jpb->jb', alpha, \
+                            exp( -1j * lam * s[:,None] ), W ).real
+                inner = einsum( 'jp,jp,jpb->jb', alpha, _phi( lam, s ), W ).real
+                M = M + einsum( 'j,ja,jb->ab', 0.5 * w_g * dt, h, inner )
+                
+            terms.append( 0.5 * einsum( 'ab,abc->c', M, F['f'] ) )
+
+        # Convert back to the frame basis and form operators.
+        return [ operator( einsum( 'a,ab,bij->ij', a, F['S'], F['basis'] ) ) \
+                 for a in terms ]
+
+
+    def _frame_bilinear( self ):
+        # Ideal control and Hamiltonians of the toggling frame,
+        # including the drift.  The controlled Hamiltonians come first,
+        # so that _error_controls() pads the drift with zeros.
+        ctrl = self.ideal_control
+        if self.drift is None:
+            return [ctrl, self.hamiltonians]
+
+        k = len( self.hamiltonians )
+        H = asarray( self.hamiltonians, complex ).reshape( (k, -1) ).T
+        d = asarray( self.drift, complex ).flatten()
+        coef = lstsq( H, d )[0]
+
+        arr = asarray( ctrl.control, float )
+        t = asarray( ctrl.times, float ).reshape( (-1, 1) )
+        if norm( d - dot( H, coef ) ) <= 1e-10 * norm( d ):
+            arr = arr + coef.real[None,:]
+            hamiltonians = self.hamiltonians
+        else:
+            arr = hstack(( arr, ones( (len(arr), 1) ) ))
+            hamiltonians = list( self.hamiltonians ) + [ self.drift ]
+
+        return [ control.control( hstack(( arr, t )) ), hamiltonians ]
+
+
+    def _error_controls( self, err = None ):
+        # Difference between the distorted and ideal controls on each
+        # time slice, padded with zeros for basis elements that are
+        # not controlled.
+        if err is None:
+            distorted = self.control
+        else:
+            distorted = err( self.ideal_control )
+
+        if not distorted.control.shape == self.ideal_control.control.shape or \
+               not ( distorted.times == self.ideal_control.times ).all():
+            raise ValueError('The error model must preserve the time ' + \
+                             'slices of the ideal control.')
+
+        delta = asarray( distorted.control - self.ideal_control.control, float )
+        m = len( self.frame_basis )
+        return hstack(( delta[:-1,:], zeros( (len(delta) - 1, m - delta.shape[1]) ) ))
+
+
+def _phi( lam, t ):
+    # Integral of exp(-i lam s) for s in (0, t).  Uses sinc so that
+    # the limit lam -> 0 is handled without cancellation.
+    t = asarray( t, float )[:,None]
+    return t * exp( -0.5j * lam * t ) * sinc( lam * t / (2*pi) )
 
 
 def imperfect_rotation( *args, **keyword_args ):
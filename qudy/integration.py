@@ -21,8 +21,30 @@
 
 from quantop import *
 from scipy.integrate import trapz, cumtrapz, simps, romb
+from numpy import einsum, dot, diff, empty, asarray, ix_, sinc, matmul, \
+     array_split, concatenate, multiply, conjugate, iscomplexobj, \
+     searchsorted, sort
+from numpy.linalg import matrix_rank, lstsq
+from numpy.linalg import eigh as _eigh
+from scipy.sparse.linalg import expm_multiply
+from multiprocessing.pool import ThreadPool
+from multiprocessing import cpu_count
+import routines
+import control
+import hamiltonian_set
+import local_operator
 
-__all__ = ['integrate','trotter','dyson','magnus','lindblad']
+# BLAS is limited to one thread within the thread pools of this
+# module, if threadpoolctl is available.
+try:
+    from threadpoolctl import threadpool_limits
+
+except ImportError:
+    threadpool_limits = None
+
+__all__ = ['integrate','trotter','splitting','adaptive','interaction', \
+           'evolve','local_evolve','adjoint','adjoint_unitary','dyson', \
+           'magnus','lindblad']
 
 def integrate( ctrl, hamiltonians, method = 'trapz' ):
     """
@@ -53,6 +75,8 @@ def integrate( ctrl, hamiltonians, method = 'trapz' ):
              2.  'cumtrapz' : cumulative trapezoidal
              3.  'romb' :     Romberg integration
              4.  'simps' :    Simpson's rule
+             5.  'latest' :   exact for controls held at their most
+                 recent value, as in the Trotter solver
              
     **Returns:**
     
@@ -67,14 +91,18 @@ def integrate( ctrl, hamiltonians, method = 'trapz' ):
     # Create an array to hold numeric values of integrals.  Since
     # integration is linear, we may integrate each control function
     # independently and perform the nessisary summation at the end.
-    intgrl = zeros( [ctrl.number_controls , 1] )
+    # Complex controls give a complex integral.
+    if iscomplexobj( ctrl.control ):
+        dtype = complex
+    else:
+        dtype = float
+    intgrl = zeros( [ctrl.number_controls , 1], dtype )
     t = ctrl.times.flatten()
     
     if method == 'trapz':
         
-        for index in range( ctrl.number_controls ):
-            y = ctrl.control[:,index].flatten()
-            intgrl[index] = trapz(y,t)
+        y = asarray( ctrl.control, dtype )
+        intgrl[:,0] = trapz( y, t, axis = 0 )
             
     elif method == 'cumtrapz':
         
@@ -90,29 +118,34 @@ def integrate( ctrl, hamiltonians, method = 'trapz' ):
         
     elif method == 'simps':
         
-        for index in range( ctrl.number_controls ):
-            y = ctrl.control[:,index].flatten()
-            intgrl[index] = simps(y,t)
+        y = asarray( ctrl.control, dtype )
+        intgrl[:,0] = simps( y, t, axis = 0 )
+
+    elif method == 'latest':
+
+        y = asarray( ctrl.control[:-1,:], dtype )
+        intgrl[:,0] = dot( diff(t), y )
             
     else:
         raise ValueError('Method %s not understood.' %(method))
     
-    # Multiply the Hamiltonians by the required integrals
-    A = 0 * hamiltonians[0]
-    for index in range( ctrl.number_controls ):
-        A = A + float(intgrl[index]) * hamiltonians[index]
+    # Multiply the Hamiltonians by the required integrals, with one
+    # product over the stack of the Hamiltonian set.
+    S = hamiltonian_set.hamiltonian_set( hamiltonians, sparse = False )
+    A = dot( intgrl[:,0], S.array.reshape( (len(S), -1) ) )
         
     # Return the integrated matrix
-    return A
+    return operator( A.reshape( (S.dimension, S.dimension) ) )
     
     
-def trotter( ctrl, hamiltonians ):
+def trotter( ctrl, hamiltonians, threads = 1 ):
     """
     Solves a bilinear control system using a Trotter formula.
     
     **Forms:**
     
-        ``trotter( ctrl, hamiltonians )``
+        * ``trotter( ctrl, hamiltonians )``
+        * ``trotter( ctrl, hamiltonians, threads = n )``
         
     **Args:**
     
@@ -121,45 +154,832 @@ def trotter( ctrl, hamiltonians ):
         * *hamiltonians* :  A list or array of k-many Hamiltonians.  
           The Hamiltonians must be square matrices of the same 
           dimensionality.
+
+    **Optional keys:**
+
+        * threads = n : Number of threads used to exponentiate and
+          multiply the slices.  If None, one thread is used for each
+          processor.  The default is 1.
           
     **Returns:**
     
         * U : Solution to bilinear control problem.
+
+    When the Hamiltonians commute, the propagator is the exponential
+    of the integrated generator, :math:`U = \\exp( -i \\sum_\\mu
+    H_\\mu \\int u_\\mu dt )`, and a single exponential is taken.
+    If they are also diagonal, only the phases on the diagonal are
+    exponentiated.
+
+    When Hermitian Hamiltonians share a block diagonal structure, for
+    instance because they conserve the total spin, each block is
+    propagated on its own and the blocks are reassembled.
+
+    With several threads the slices are divided into chunks.  Each
+    thread exponentiates a chunk of slices, with one batched
+    eigendecomposition when the generators are Hermitian, and
+    multiplies them.  The chunk products are combined by a tree
+    reduction.  Only the order of the products changes, so the result
+    agrees with the serial solution to rounding error.  Within the
+    thread pool BLAS is limited to one thread when threadpoolctl is
+    installed.  Otherwise set e.g. ``OMP_NUM_THREADS=1`` to avoid
+    oversubscribing the processors.
     """
-    
-    # Initialize propagator for the control system
-    dimension = sqrt( hamiltonians[0].size )
-    U = operator( eye( dimension ) )
-    
-    # For each discrete timestep, the controls are assumed constant.
-    # Then on each timestep the propagator is exp(-i H dt).  For each
-    # timestep, calculate the Hamiltonian and pulse duration.
-    
-    for timestep in range( len(ctrl.times) - 1 ):
-        
-        # Calculate pulse duration
-        dt = ctrl.times[ timestep + 1 ] - ctrl.times[ timestep ]
-        dt = float(dt)
-        
-        # Construct Hamiltonian over this interval
-        c = ctrl.control[timestep,:]
-        H = 0 * hamiltonians[0]
-        for index in range( ctrl.number_controls ):
-            H = H + c[index] * hamiltonians[index]
-            
-        # Compute propagator for this interval
-        #try:
-        Ut = operator( expm( -1j * H * dt ) )
-        #except ValueError:
-        #    print "Exponentiation failed, \ndt:%.4e\nH:%s" %(dt,H.__repr__())
-        
-        # Append evolution
-        U = operator( Ut * U )
-        
-    # Return propagator
+
+    # Commutation and block structure are found once per Hamiltonian
+    # set and cached.  The propagator is a dense matrix, so sparse
+    # sets are converted.
+    S = hamiltonian_set.hamiltonian_set( hamiltonians, sparse = False )
+    if S.commuting:
+        A = integrate( ctrl, S, method = 'latest' )
+        if S.diagonal:
+            return operator( diag( exp( -1j * diag( A ) ) ) )
+        return operator( expm( -1j * A ) )
+
+    # Blocks are exponentiated from their eigendecompositions, which
+    # requires Hermitian generators.
+    if threads is None:
+        threads = cpu_count()
+    hermitian = S.hermitian and not iscomplexobj( ctrl.control )
+    if ( len( S.blocks ) > 1 and hermitian ) or threads > 1:
+        return operator( _block_trotter( ctrl, S, threads ) )
+
+    # Otherwise the slices are exponentiated in turn.
+    return operator( _serial_trotter( ctrl, S ) )
+
+
+# Splitting schemes.  Each scheme is a list [c, a] of quadrature
+# nodes c, as fractions of a slice, and a stage matrix a.  Stage s of
+# a slice of duration dt is the exponential of -i dt sum_q a[s,q]
+# H(t + c[q] dt), and the stages act in the order listed.
+_yoshida = 1.0 / ( 2.0 - 2.0**(1.0/3.0) )
+_splitting_schemes = {
+    'midpoint' : [ [0.5], [[1.0]] ],
+    'yoshida' : [ [ _yoshida / 2.0, 0.5, 1.0 - _yoshida / 2.0 ], \
+                  [[ _yoshida, 0, 0 ], [ 0, 1.0 - 2.0 * _yoshida, 0 ], \
+                   [ 0, 0, _yoshida ]] ],
+    'cfm4' : [ [ 0.5 - sqrt(3.0) / 6.0, 0.5 + sqrt(3.0) / 6.0 ], \
+               [[ 0.25 + sqrt(3.0) / 6.0, 0.25 - sqrt(3.0) / 6.0 ], \
+                [ 0.25 - sqrt(3.0) / 6.0, 0.25 + sqrt(3.0) / 6.0 ]] ] }
+
+
+def splitting( ctrl, hamiltonians, method = 'cfm4', substeps = 1 ):
+    """
+    Solves a bilinear control system with a second or fourth order
+    splitting method.  Unlike the Trotter solver, which holds the
+    controls at their sampled values, the controls are evaluated at
+    interior points of each time slice using the interpolation method
+    of the control, see ``control.sample()``.
+
+    **Forms:**
+
+        * ``splitting( ctrl, hamiltonians )``
+        * ``splitting( ctrl, hamiltonians, method = 'method' )``
+        * ``splitting( ctrl, hamiltonians, substeps = n )``
+
+    **Args:**
+
+        * *ctrl* :   An instance of the control class.  Contains
+          time information as well as k-many control functions.
+        * *hamiltonians* :  A list or array of k-many Hamiltonians.
+          The Hamiltonians must be square matrices of the same
+          dimensionality.
+
+    **Optional keys:**
+
+        * method = 'method' : The splitting scheme.  The method may
+          be one of the following options.
+
+             1. 'midpoint' : exponential midpoint rule, second order.
+             2. 'yoshida' : Suzuki-Yoshida triple jump composition of
+                the midpoint rule, fourth order.
+             3. 'cfm4' : commutator-free Magnus integrator with two
+                exponentials and two Gauss-Legendre nodes, fourth
+                order.
+
+        * substeps = n : Number of steps taken on each time slice.
+          The default is 1.
+
+    **Returns:**
+
+        * U : Solution to bilinear control problem.
+
+    The order holds when the interpolated controls are smooth over
+    each step, which is the case for 'linear' interpolation.  With
+    'latest' interpolation the controls are constant over each slice,
+    and every method reproduces the Trotter solver.  When the
+    Hamiltonians are Hermitian and the controls real, the
+    exponentials of all stages are found with one batched
+    eigendecomposition per block of the Hamiltonians.  Otherwise they
+    are found one at a time with ``expm()``.
+    """
+
+    # Check user supplied inputs
+    if not ctrl.number_controls == len(hamiltonians):
+        raise ValueError('Bilinear dimension mismatch.')
+    if not method in _splitting_schemes:
+        raise ValueError('Method %s not understood.' %(method))
+
+    [c, a] = [ asarray( x, float ) for x in _splitting_schemes[method] ]
+
+    # Start times and durations of the steps, and the controls at
+    # every quadrature node.
+    t = asarray( ctrl.times, float ).flatten()
+    s = ( arange( substeps ) / float( substeps ) )[None,:] * diff( t )[:,None]
+    dt = ( diff( t ) / substeps ).repeat( substeps )
+    s = ( t[:-1,None] + s ).flatten()
+    u = ctrl.sample( ( s[:,None] + c[None,:] * dt[:,None] ).clip( t[0], t[-1] ) )
+    u = u.reshape( (len(dt), len(c), ctrl.number_controls) )
+
+    # Controls of each stage, in order of application.
+    v = einsum( 'sq,jqk,j->jsk', a, u, dt ).reshape( (-1, ctrl.number_controls) )
+
+    S = hamiltonian_set.hamiltonian_set( hamiltonians, sparse = False )
+    hermitian = S.hermitian and not iscomplexobj( v )
+    U = zeros( (S.dimension, S.dimension), complex )
+
+    for index in S.blocks:
+        Hb = S.array[:,index][:,:,index]
+        P = _exponentials( einsum( 'jk,kab->jab', v, Hb ), hermitian )
+        Ub = eye( len( index ) )
+        for j in range( len(P) ):
+            Ub = dot( P[j], Ub )
+        U[ ix_( index, index ) ] = Ub
+
+    return operator( U )
+
+
+def adaptive( ctrl, hamiltonians, tol = 1e-8, full_output = False, **keys ):
+    """
+    Solves a bilinear control system with adaptive, error controlled
+    time steps.  The controls may be a control instance or a list of
+    functions, so that no sampling density need be chosen.
+
+    **Forms:**
+
+        * ``adaptive( ctrl, hamiltonians )``
+        * ``adaptive( [u_1, ..., u_k], hamiltonians, interval = (t0, t1) )``
+        * ``adaptive( ctrl, hamiltonians, tol = 1e-8, full_output = True )``
+
+    **Args:**
+
+        * *ctrl* : An instance of the control class, which is
+          evaluated with its interpolation method, see
+          ``control.sample()``.
+        * *u* : k-many functions of time, which return the control
+          amplitudes.
+        * *hamiltonians* :  A list or array of k-many Hamiltonians.
+          The Hamiltonians must be square matrices of the same
+          dimensionality.
+
+    **Optional keys:**
+
+        * tol = float : Tolerance on the global error of U, in the
+          spectral norm.  The default is 1e-8.
+        * interval = (t0, t1) : Time interval, required when the
+          controls are functions.
+        * step = float : Length of the first step.  The default is a
+          sixteenth of the interval.
+        * full_output = bool : If True, information about the steps
+          is also returned.
+
+    **Returns:**
+
+        * U : Solution to bilinear control problem.
+        * info : Returned if full_output is True.  A dictionary with
+          the number of accepted and rejected steps under 'steps' and
+          'rejected', the number of exponentials under
+          'exponentials', the estimated global error under 'error',
+          and the step boundaries under 'times'.
+
+    **Raises:**
+
+        * ``ValueError`` : The step size became too small.
+
+    Each step is taken with the fourth order commutator-free Magnus
+    method of ``splitting()``, once over the whole step and once as
+    two half steps.  The difference between the full step and the two
+    half steps estimates the local error of the half steps, which are
+    kept.  A step is accepted when its error is below its share of the
+    tolerance, :math:`\\epsilon \\, h / T`, so that the local errors
+    add up to at most :math:`\\epsilon`.  The estimated global error
+    is the sum of the local errors.  For Hermitian generators the six
+    exponentials of a step are found with one batched
+    eigendecomposition.
+
+    The estimate assumes that the controls are smooth within each
+    step.  For a control instance no step crosses a sample time, nor
+    for 'nearest' interpolation a midpoint between samples.  Control
+    functions are assumed to be smooth.
+    """
+
+    # Controls at an array of times, as an (m, k) array.  The
+    # interpolated controls of a control instance jump or kink at the
+    # breaks, which no step may span.
+    if isinstance( ctrl, control.control ):
+        [t0, t1] = [ ctrl.timemin(), ctrl.timemax() ]
+        values = lambda s: asarray( ctrl.sample( s.clip( t0, t1 ) ) )
+        number_controls = ctrl.number_controls
+        breaks = asarray( ctrl.times, float ).flatten()
+        if ctrl.interpolation == 'nearest':
+            middle = ( breaks[1:] + breaks[:-1] ) / 2
+            breaks = sort( hstack( ( breaks, middle ) ) )
+    else:
+        if not 'interval' in keys:
+            raise ValueError('An interval is required for control functions.')
+        [t0, t1] = [ float( x ) for x in keys['interval'] ]
+        u = list( ctrl )
+        values = lambda s: array( [ [ f( x ) for f in u ] for x in s ] )
+        number_controls = len( u )
+        breaks = array( [t0, t1] )
+
+    # Check user supplied inputs
+    if not number_controls == len(hamiltonians):
+        raise ValueError('Bilinear dimension mismatch.')
+
+    S = hamiltonian_set.hamiltonian_set( hamiltonians, sparse = False )
+    [c, a] = [ asarray( x, float ) for x in _splitting_schemes['cfm4'] ]
+    T = t1 - t0
+
+    # Nodes and stage weights of a full step followed by two half
+    # steps, as fractions of the step.
+    nodes = hstack( ( c, c / 2, 0.5 + c / 2 ) )
+    weights = zeros( (6, 6) )
+    weights[0:2,0:2] = a
+    weights[2:4,2:4] = a / 2
+    weights[4:6,4:6] = a / 2
+
+    U = eye( S.dimension, dtype = complex )
+    h = float( keys.get( 'step', T / 16.0 ) )
+    t = t0
+    times = [t0]
+    info = { 'steps' : 0, 'rejected' : 0, 'exponentials' : 0, 'error' : 0.0 }
+
+    while t1 - t > 1e-14 * T:
+
+        # Steps end at the next break at the latest.
+        edge = breaks[ searchsorted( breaks, t + 1e-14 * T, 'right' ) ]
+        proposal = h
+        clipped = h >= edge - t
+        if clipped:
+            h = edge - t
+        if h < 1e-12 * T:
+            raise ValueError('Step size underflow at t = %.4E.' %(t))
+
+        v = h * dot( weights, values( t + nodes * h ) )
+        G = einsum( 'jk,kab->jab', v, S.array )
+        P = _exponentials( G, S.hermitian and not iscomplexobj( v ) )
+        info['exponentials'] = info['exponentials'] + 6
+
+        full = dot( P[1], P[0] )
+        half = dot( P[5], dot( P[4], dot( P[3], P[2] ) ) )
+        err = norm( full - half, 2 ) / 15.0
+
+        # Accept or reject the step, and choose the next step size.
+        # The local error of a fourth order step is O(h^5).  Errors at
+        # the level of rounding are always accepted, so that short
+        # steps up to a break do not underflow.
+        allowed = max( tol * h / T, 1e-14 )
+        accepted = err <= allowed
+        if accepted:
+            U = dot( half, U )
+            t = edge if clipped else t + h
+            times.append( t )
+            info['steps'] = info['steps'] + 1
+            info['error'] = info['error'] + err
+        else:
+            info['rejected'] = info['rejected'] + 1
+
+        # A step shortened to reach a break does not limit the next.
+        factor = 0.9 * ( allowed / max( err, 1e-300 ) )**0.25
+        h = h * min( 4.0, max( 0.2, factor ) )
+        if clipped and accepted:
+            h = max( h, proposal )
+
+    info['times'] = array( times )
+
+    if full_output:
+        return [operator( U ), info]
+    return operator( U )
+
+
+def interaction( ctrl, hamiltonians, drift, frame = 'lab' ):
+    """
+    Solves a bilinear control system with a static drift Hamiltonian,
+    :math:`H(t) = H_0 + \\sum_\\mu u_\\mu(t) H_\\mu`, in the
+    interaction picture of the drift.
+
+    **Forms:**
+
+        * ``interaction( ctrl, hamiltonians, drift )``
+        * ``interaction( ctrl, hamiltonians, drift, frame = 'rotating' )``
+
+    **Args:**
+
+        * *ctrl* :   An instance of the control class.  Contains
+          time information as well as k-many control functions.
+        * *hamiltonians* :  A list or array of k-many Hamiltonians.
+        * *drift* : The drift Hamiltonian :math:`H_0`.
+
+    **Optional keys:**
+
+        * frame = 'frame' : Either 'lab', for the propagator
+          :math:`U(T)`, or 'rotating', for the interaction picture
+          propagator :math:`U_I(T) = e^{i H_0 T} U(T)`.  Times are
+          measured from the first time value.
+
+    **Returns:**
+
+        * U : Solution to bilinear control problem.
+
+    The control Hamiltonians are transformed once into the eigenbasis
+    of the drift, where :math:`e^{i H_0 t} H_\\mu e^{-i H_0 t}` has the
+    elements :math:`e^{i \\omega_{ab} t} (H_\\mu)_{ab}` with
+    :math:`\\omega_{ab} = E_a - E_b`.  The phases are found for all
+    slice times at once.  On each slice the controls are constant, as
+    in the Trotter solver, and the rotating frame generator is
+    integrated exactly over the slice.  That is the first term of the
+    Magnus expansion.  Its error depends on the size of the controls
+    and not on the drift, so the slices may be much longer than the
+    period of the drift.
+    """
+
+    # Check user supplied inputs
+    if not ctrl.number_controls == len(hamiltonians):
+        raise ValueError('Bilinear dimension mismatch.')
+    if not frame in ['lab', 'rotating']:
+        raise ValueError('Frame %s not understood.' %(frame))
+
+    S = hamiltonian_set.hamiltonian_set( hamiltonians, sparse = False )
+    [E,W] = _eigh( asarray( drift, complex ) )
+    H = einsum( 'ia,kij,jb->kab', W.conj(), S.array, W )
+    w = E[:,None] - E[None,:]
+
+    # Integral of the rotating phases over each slice.
+    t = asarray( ctrl.times, float ).flatten()
+    dt = diff( t )
+    s = t[:-1] - t[0]
+    F = exp( 1j * w * s[:,None,None] ) * dt[:,None,None] * \
+        exp( 0.5j * w * dt[:,None,None] ) * sinc( w * dt[:,None,None] / (2*pi) )
+
+    # Exponentiate every slice with one batched call.
+    u = asarray( ctrl.control[:-1,:], float )
+    Omega = einsum( 'jk,kab->jab', u, H ) * F
+    [lam,V] = _eigh( Omega )
+    P = einsum( 'jab,jb,jcb->jac', V, exp( -1j * lam ), V.conj() )
+
+    U = eye( len(E), dtype = complex )
+    for j in range( len(dt) ):
+        U = dot( P[j], U )
+
+    if frame == 'lab':
+        U = exp( -1j * E * ( t[-1] - t[0] ) )[:,None] * U
+    return operator( dot( W, dot( U, W.conj().T ) ) )
+
+
+def evolve( ctrl, hamiltonians, state ):
+    """
+    Propagates a state vector, or a small block of them, through a
+    bilinear control system without forming the propagator.  Memory is
+    linear in the dimension of the Hilbert space, so registers of many
+    qubits may be simulated with sparse Hamiltonians.
+
+    **Forms:**
+
+        * ``evolve( ctrl, hamiltonians, psi )``
+
+    **Args:**
+
+        * *ctrl* :   An instance of the control class.  Contains
+          time information as well as k-many control functions.
+        * *hamiltonians* :  A list of k-many Hamiltonians, which may
+          be dense, scipy.sparse matrices or pauli strings, or a
+          hamiltonian_set.
+        * *psi* : An N-element state vector, or an (N, m) array whose
+          columns are m state vectors.
+
+    **Returns:**
+
+        * psi : The states at the final time, with the shape of the
+          input.
+
+    As in the Trotter solver the controls are constant over each time
+    slice.  The action of each slice exponential is found with
+    ``scipy.sparse.linalg.expm_multiply``.  The slice generators share
+    the common sparsity pattern of the Hamiltonians, see
+    ``hamiltonian_set.pattern``, so each one costs a single product of
+    the controls with the stored elements.
+    """
+
+    # Check user supplied inputs
+    if not ctrl.number_controls == len(hamiltonians):
+        raise ValueError('Bilinear dimension mismatch.')
+
+    H = hamiltonian_set.hamiltonian_set( hamiltonians )
+    psi = asarray( state, complex )
+    if not psi.shape[0] == H.dimension:
+        raise ValueError('State dimension mismatch.')
+
+    [P, D] = H.pattern
+    G = P.copy()
+    dt = diff( asarray( ctrl.times, float ).flatten() )
+    u = asarray( ctrl.control[:-1,:], float )
+
+    for j in range( len(dt) ):
+        G.data = -1j * dt[j] * dot( u[j], D )
+        psi = expm_multiply( G, psi )
+
+    return psi
+
+
+def local_evolve( ctrl, hamiltonians, state, order = 2 ):
+    """
+    Propagates states through a bilinear control system whose
+    Hamiltonians act on a few qubits each.  The exponential of each
+    local term is a small matrix, which is contracted into the state
+    tensor, so no register sized matrices are formed.
+
+    **Forms:**
+
+        * ``local_evolve( ctrl, hamiltonians, psi )``
+        * ``local_evolve( ctrl, hamiltonians, psi, order = n )``
+
+    **Args:**
+
+        * *ctrl* :   An instance of the control class.  Contains
+          time information as well as k-many control functions.
+        * *hamiltonians* :  A list of k-many local operators on the
+          same register.
+        * *psi* : A state vector of :math:`2^n` elements, or a
+          :math:`(2^n, m)` array whose columns are m state vectors.
+
+    **Optional keys:**
+
+        * order = n : Order of the Trotter splitting between terms
+          that act on different qubits, either 1 or 2.  The second
+          order splitting is symmetric.  The default is 2.
+
+    **Returns:**
+
+        * psi : The states at the final time, with the shape of the
+          input.
+
+    Terms acting on the same qubits are summed before they are
+    exponentiated, so within each such group the slice exponential is
+    exact.  The exponentials of every group and slice are found from
+    one batched eigendecomposition per group.
+    """
+
+    # Check user supplied inputs
+    if not ctrl.number_controls == len(hamiltonians):
+        raise ValueError('Bilinear dimension mismatch.')
+    if not local_operator.is_local( hamiltonians ):
+        raise ValueError('Hamiltonians must be local operators on the ' + \
+                         'same register.')
+    if not order in [1, 2]:
+        raise ValueError('Only first and second order splittings are ' + \
+                         'supported.')
+
+    n = hamiltonians[0].number_qubits
+    psi = asarray( state, complex )
+    if not psi.shape[0] == 2**n:
+        raise ValueError('State dimension mismatch.')
+
+    dt = diff( asarray( ctrl.times, float ).flatten() )
+    u = asarray( ctrl.control[:-1,:], float )
+    step = dt / order
+
+    # Group the terms by the qubits they act on, and exponentiate the
+    # generator of each group on every slice.
+    groups = []
+    for (k, h) in enumerate( hamiltonians ):
+        for g in groups:
+            if g[0] == h.qubits:
+                g[1].append( k )
+                break
+        else:
+            groups.append( [h.qubits, [k]] )
+
+    slices = []
+    for [qubits, terms] in groups:
+        M = asarray( [ hamiltonians[k].matrix for k in terms ] )
+        [w,V] = _eigh( einsum( 'jk,kab->jab', u[:,terms], M ) )
+        slices.append( einsum( 'jab,jb,jcb->jac', V, \
+                               exp(-1j * w * step[:,None]), V.conj() ) )
+
+    # Apply the groups in turn on each slice.  The second order
+    # splitting applies them forwards and then backwards, each for
+    # half of the slice.
+    T = psi.reshape( (2,) * n + psi.shape[1:] )
+    sequence = range( len( groups ) )
+    if order == 2:
+        sequence = sequence + sequence[::-1]
+
+    for j in range( len(dt) ):
+        for g in sequence:
+            T = local_operator.apply( T, groups[g][0], slices[g][j] )
+
+    return T.reshape( psi.shape )
+
+
+def _exponentials( G, hermitian = True ):
+    # Exponentials exp(-i G_j) of a stack of generators.  Hermitian
+    # generators are exponentiated with one batched
+    # eigendecomposition, others one at a time with expm().
+    if hermitian:
+        [w,V] = _eigh( G )
+        return einsum( 'jab,jb,jcb->jac', V, exp( -1j * w ), V.conj() )
+
+    P = empty( G.shape, complex )
+    for j in range( len(G) ):
+        P[j] = expm( -1j * G[j] )
+    return P
+
+
+def _serial_trotter( ctrl, S ):
+    # Trotter solution on preallocated buffers.  The slice generator,
+    # the phases and the running product are written in place, so a
+    # slice allocates only the outputs of the exponential.  Hermitian
+    # generators are exponentiated from their eigendecomposition,
+    # U <- V exp(-i w dt) V^dagger U, other generators with expm().
+    N = S.dimension
+    H = S.array.reshape( (len(S), N * N) )
+    dt = diff( asarray( ctrl.times, float ).flatten() )
+    u = asarray( ctrl.control[:-1,:], complex )
+    hermitian = S.hermitian and not iscomplexobj( ctrl.control )
+
+    G = empty( N * N, complex )
+    phase = empty( N, complex )
+    W = empty( (N,N), complex )
+    X = empty( (N,N), complex )
+    U = eye( N, dtype = complex )
+
+    for j in range( len(dt) ):
+
+        # Generator of this slice, sum_mu u_mu H_mu.
+        dot( u[j], H, out = G )
+
+        if hermitian:
+            [w,V] = _eigh( G.reshape( (N,N) ) )
+            multiply( w, -1j * dt[j], out = phase )
+            exp( phase, out = phase )
+            conjugate( V, out = W )
+            dot( W.T, U, out = X )
+            X *= phase[:,None]
+            dot( V, X, out = U )
+        else:
+            G *= -1j * dt[j]
+            dot( expm( G.reshape( (N,N) ) ), U, out = X )
+            [U, X] = [X, U]
+
     return U
 
 
+def _block_trotter( ctrl, H, threads = 1 ):
+    # Trotter solution for a block diagonal Hamiltonian set.  The
+    # slice propagators of each block are found from one batched
+    # eigendecomposition of the slice generators, or with expm() when
+    # the generators are not Hermitian, see _exponentials().  With more
+    # than one thread the slices are split into chunks, which are
+    # exponentiated and multiplied on a thread pool.  NumPy releases
+    # the GIL in LAPACK and in matmul, so the chunks run concurrently.
+    if threads > 1 and threadpool_limits is not None:
+        with threadpool_limits( limits = 1 ):
+            return _chunked_trotter( ctrl, H, threads )
+    return _chunked_trotter( ctrl, H, threads )
+
+
+def _chunked_trotter( ctrl, H, threads ):
+    dt = diff( asarray( ctrl.times, float ).flatten() )
+    u = asarray( ctrl.control[:-1,:] ) * dt[:,None]
+    hermitian = H.hermitian and not iscomplexobj( u )
+    U = zeros( (H.dimension, H.dimension), complex )
+
+    # At least one chunk for each thread, and at most _chunk slices
+    # in a chunk, which bounds the memory used for the slices.
+    number_chunks = max( threads, -( -len(dt) // _chunk ) )
+    chunks = array_split( arange( len(dt) ), number_chunks )
+    pool = ThreadPool( threads ) if threads > 1 else None
+
+    try:
+        for index in H.blocks:
+            Hb = H.array[:,index][:,:,index]
+
+            def product( j ):
+                G = einsum( 'jk,kab->jab', u[j], Hb )
+                return _tree_product( _exponentials( G, hermitian ) )
+
+            if pool is None:
+                P = asarray( map( product, chunks ) )
+            else:
+                P = asarray( pool.map( product, chunks ) )
+            U[ ix_( index, index ) ] = _tree_product( P, pool, threads )
+
+    finally:
+        if pool is not None:
+            pool.close()
+
+    return U
+
+
+# Largest number of slices exponentiated in one batch.
+_chunk = 4096
+
+
+def _tree_product( P, pool = None, threads = 1 ):
+    # Time ordered product P[n-1] ... P[1] P[0] of a stack of
+    # matrices.  Neighbouring pairs are multiplied with one batched
+    # matmul per level, so there are log2(n) calls rather than n.
+    # With a thread pool the pairs of each level are shared among the
+    # threads.
+    if len( P ) == 0:
+        return eye( P.shape[-1], dtype = complex )
+
+    while len( P ) > 1:
+        m = len( P ) // 2
+        [A, B] = [ P[1:2*m:2], P[0:2*m:2] ]
+        if pool is None or m < 2 * threads:
+            Q = matmul( A, B )
+        else:
+            parts = array_split( arange( m ), threads )
+            Q = concatenate( pool.map( lambda i: matmul( A[i], B[i] ), parts ) )
+        if len( P ) % 2:
+            Q = concatenate( ( Q, P[-1:] ) )
+        P = Q
+
+    return P[0]
+
+
+def adjoint( ctrl, hamiltonians, full_output = False ):
+    """
+    Solves a bilinear control system in the adjoint representation.
+    Rather than N x N unitaries, the solver propagates real orthogonal
+    m x m matrices, where m is the dimension of the dynamical Lie
+    algebra.  This is useful when m is small compared to N, and it
+    gives the trajectories of expectation values directly, see
+    ``propagator.bloch()``.
+
+    **Forms:**
+
+        * ``adjoint( ctrl, hamiltonians )``
+        * ``adjoint( ctrl, hamiltonians, full_output = True )``
+
+    **Args:**
+
+        * *ctrl* :   An instance of the control class.  Contains
+          time information as well as k-many control functions.
+        * *hamiltonians* :  A list or array of k-many Hamiltonians.
+          The Hamiltonians must be square matrices of the same
+          dimensionality.
+
+    **Optional keys:**
+
+        * full_output = bool : If True, also return a dictionary with
+          the orthonormal basis, the structure constants and the
+          eigendecompositions of the slice generators.
+
+    **Returns:**
+
+        * [R, basis] : R is an (n, m, m) array with the adjoint
+          representation at each of the n sampled times, such that
+          :math:`U^\\dagger(t) B_a U(t) = \\sum_b R_{ab}(t) B_b`.
+          basis is the (m, N, N) array of the :math:`B_a`.  It
+          begins with the Hamiltonians, and is extended by the
+          remaining elements of the dynamical Lie algebra when the
+          Hamiltonians do not close under commutation.
+
+    The slice generators :math:`A_j = -\\sum_a u_a f_{abc}` are real
+    and antisymmetric, so :math:`i A_j` is diagonalized for all slices
+    in one batched call.  The result may be mapped back to a unitary
+    with ``adjoint_unitary()``.
+    """
+
+    # Check user supplied inputs
+    if not ctrl.number_controls == len(hamiltonians):
+        raise ValueError('Bilinear dimension mismatch.')
+    hamiltonians = hamiltonian_set.hamiltonian_set( hamiltonians, \
+                                                    sparse = False )
+
+    # Build an orthonormal basis E for the Lie algebra and the
+    # structure constants -i[E_a,E_b] = f_abc E_c.
+    basis = _adjoint_basis( hamiltonians )
+    gram = einsum( 'aij,bji->ab', basis, basis ).real
+    [w,V] = _eigh( gram )
+    S = dot( V / sqrt(w), V.T )            # gram^(-1/2)
+    Sinv = dot( V * sqrt(w), V.T )         # gram^(+1/2)
+    E = einsum( 'ab,bij->aij', S, basis )
+    f = routines.structure_constants( E )
+
+    # Controls in orthonormal coordinates.  As in the Trotter solver,
+    # the controls are constant over each time slice.
+    k = len( hamiltonians )
+    dt = diff( asarray( ctrl.times, float ).flatten() )
+    u = dot( asarray( ctrl.control[:-1,:], float ), Sinv[0:k,:] )
+
+    # exp(s A_j) = V exp(-i lambda s) V^dagger is real orthogonal.
+    A = - einsum( 'ja,abc->jbc', u, f )
+    [lam,V] = _eigh( 1j * A )
+    P = einsum( 'jab,jb,jcb->jac', V, exp(-1j * lam * dt[:,None]), \
+                V.conj() ).real
+
+    # Accumulate Q_(j+1) = P_j Q_j along the trajectory.
+    m = len( basis )
+    Q = empty( (len(dt) + 1, m, m) )
+    Q[0] = eye( m )
+    for j in range( len(dt) ):
+        Q[j+1] = dot( P[j], Q[j] )
+
+    R = einsum( 'ab,jbc,cd->jad', Sinv, Q, S )
+    if full_output:
+        info = { 'basis' : basis, 'S' : S, 'Sinv' : Sinv, 'f' : f,
+                 'dt' : dt, 'lam' : lam, 'V' : V, 'Q' : Q }
+        return [R, basis, info]
+
+    return [R, basis]
+
+
+def adjoint_unitary( R, basis ):
+    """
+    Maps the adjoint representation of a propagator back onto a
+    unitary.  Inverse of ``adjoint()``.
+
+    **Forms:**
+
+        * ``adjoint_unitary( R, basis )``
+
+    **Args:**
+
+        * *R* : An (m, m) array of adjoint representation
+          coefficients, :math:`U^\\dagger B_a U = \\sum_b R_{ab} B_b`,
+          or an array of them with shape (..., m, m).
+        * *basis* : The (m, N, N) array of basis operators.
+
+    **Returns:**
+
+        * U : The N x N unitary with unit determinant, or an array of
+          them with shape (..., N, N).
+
+    **Raises:**
+
+        * ``ValueError`` : The unitary is not unique, because the Lie
+          algebra acts reducibly.
+
+    U solves the linear equations :math:`B_a U - U C_a = 0`, where
+    :math:`C_a = \\sum_b R_{ab} B_b`, and is found as the least
+    singular vector of an :math:`N^2 \\times N^2` matrix.  It is
+    unique up to a global phase when the Lie algebra acts irreducibly,
+    for instance for :math:`su(N)`.  Otherwise any operator commuting
+    with the algebra also solves the equations, and the least singular
+    value is degenerate.
+    """
+    R = asarray( R, float )
+    B = asarray( basis, complex )
+    N = B.shape[-1]
+    C = einsum( '...ab,bij->...aij', R, B )
+
+    # Gram matrix K = sum_a M_a^dagger M_a of the row-major
+    # vectorization, M_a = B_a x 1 - 1 x C_a^T.  The basis and its
+    # image are Hermitian, which halves the cross terms.
+    I = eye( N )
+    K = kron( einsum( 'aij,ajk->ik', B, B ), I ) + \
+        einsum( 'ik,...jl->...ijkl', I, \
+                einsum( '...aij,...ajk->...ik', C, C ).conj() \
+                ).reshape( R.shape[:-2] + (N*N, N*N) ) - \
+        2 * einsum( 'aik,...ajl->...ijkl', B, C.conj() \
+                ).reshape( R.shape[:-2] + (N*N, N*N) )
+
+    # The solution is unique only if the least eigenvalue of K is
+    # separated from the next one.
+    [w,V] = _eigh( K )
+    if ( w[...,1] - w[...,0] <= 1e-10 * w[...,-1] ).any():
+        raise ValueError('The unitary is not determined by its adjoint ' + \
+                         'representation, the Lie algebra is reducible.')
+    U = V[...,0].reshape( R.shape[:-2] + (N,N) ) * sqrt( N )
+
+    # Remove the global phase.
+    d = det( U )
+    return U * ( abs( d ) / d )[...,None,None]**( 1.0 / N )
+
+
+def _adjoint_basis( hamiltonians, tol = 1e-10 ):
+    # Basis used for the adjoint representation.  Starts from the
+    # Hamiltonians and appends any elements of the dynamical Lie
+    # algebra which they do not already span.
+    basis = [ asarray( h, complex ) for h in hamiltonians ]
+    flat = array( [ b.flatten() for b in basis ] ).T
+    if matrix_rank( flat, tol * abs( flat ).max() ) < len( basis ):
+        raise ValueError('Hamiltonians must be linearly independent.')
+
+    for a in routines.generate_algebra( hamiltonians ):
+        h = 1j * asarray( a ).flatten()
+        coef = lstsq( flat, h )[0]
+        if norm( h - dot( flat, coef ) ) > tol * norm( h ):
+            basis.append( h.reshape( basis[0].shape ) )
+            flat = hstack(( flat, h[:,None] ))
+
+    return array( basis )
+
+
 def dyson( ctrl, hamiltonians, order = 4 ):
     """
     Solves a bilinear control system using a Dyson series.  By
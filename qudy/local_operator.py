@@ -0,0 +1,204 @@
+# LOCAL_OPERATOR.PY
+#
+# Hamiltonians which act on a few qubits of a large register
+#
+# Copyright (C) 2011, 2012 True Merrill
+# Georgia Institute of Technology
+# School of Chemistry and Biochemistry
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from quantop import *
+from numpy import asarray, tensordot, moveaxis, array_equal, argsort, transpose
+from scipy.sparse import identity
+from scipy.sparse import kron as _kron
+import pauli
+
+__all__ = ['local_operator','is_local']
+
+
+class local_operator( object ):
+    """
+    class for Hamiltonians which act on a few qubits of a register.
+    Only the small matrix on the named qubits is stored.  The
+    operator on the register is :math:`h \\otimes I`, with the factors
+    placed on the named qubits.
+
+    **Forms:**
+
+       * ``local_operator( h, qubits, number_qubits )``
+       * ``local_operator( P )``
+
+    **Args:**
+
+       * *h* : A :math:`2^m \\times 2^m` matrix.
+       * *qubits* : A list of the m qubits on which h acts.  Qubit 0
+         is the first tensor factor, so ``local_operator( Hz|Hz, [0,1],
+         n )`` is ``Hz|Hz|I|...|I``.
+       * *number_qubits* : Number of qubits in the register.
+       * *P* : A pauli string.  The local operator acts on the
+         support of P.
+
+    Lists of local operators are accepted by ``propagator`` and
+    ``integration.local_evolve()``, which apply the exponential of each
+    term to a state vector without forming register sized matrices.
+    The matrices on the register are only formed on request, see
+    ``dense()`` and ``sparse()``.
+    """
+
+    def __init__( self, *args ):
+        """Initialize the local_operator instance."""
+
+        if len( args ) == 1 and isinstance( args[0], pauli.pauli ):
+            P = args[0]
+            label = P.label()
+            qubits = [ j for j in range( P.number_qubits ) if label[j] != 'I' ]
+            small = ''.join( [ label[j] for j in qubits ] )
+            h = P.coefficient() * asarray( pauli.pauli( small ).dense() ) \
+                if qubits else array( [[ P.coefficient() ]] )
+            number_qubits = P.number_qubits
+
+        elif len( args ) == 3:
+            [h, qubits, number_qubits] = args
+
+        else:
+            raise SyntaxError("Improper number of arguments.")
+
+        self.matrix = asarray( h, complex )
+        self.qubits = tuple( [ int( q ) for q in qubits ] )
+        self.number_qubits = int( number_qubits )
+
+        if not self.matrix.shape == ( 2**len( self.qubits ), ) * 2:
+            raise ValueError('Matrix dimension does not match the number ' + \
+                             'of qubits.')
+        if not len( set( self.qubits ) ) == len( self.qubits ) or \
+               ( self.qubits and not 0 <= min( self.qubits ) <= \
+                 max( self.qubits ) < self.number_qubits ):
+            raise ValueError('Qubits must be distinct and within the register.')
+
+
+    def __repr__( self ):
+        """
+        Function to display local_operator objects when called on the
+        command line.
+        """
+        return '%i-qubit operator on qubits %s of %i' %( len( self.qubits ), \
+               list( self.qubits ), self.number_qubits )
+
+
+    def __eq__( self, h ):
+        if not isinstance( h, local_operator ):
+            return False
+        return self.qubits == h.qubits and \
+               self.number_qubits == h.number_qubits and \
+               array_equal( self.matrix, h.matrix )
+
+
+    def __ne__( self, h ):
+        return not self == h
+
+
+    def __mul__( self, c ):
+        return local_operator( c * self.matrix, self.qubits, self.number_qubits )
+
+
+    def __rmul__( self, c ):
+        return self * c
+
+
+    def __array__( self, dtype = None ):
+        if dtype is None:
+            return asarray( self.dense() )
+        return asarray( self.dense(), dtype )
+
+
+    @property
+    def shape( self ):
+        """
+        Shape of the operator on the register.
+        """
+        return ( 2**self.number_qubits, ) * 2
+
+
+    def dense( self ):
+        """
+        Returns the matrix of self on the register as an operator.
+        """
+        return operator( self.sparse().toarray() )
+
+
+    def sparse( self ):
+        """
+        Returns the matrix of self on the register as a scipy.sparse
+        csr_matrix.
+        """
+        n = self.number_qubits
+        m = len( self.qubits )
+        rest = [ q for q in range( n ) if not q in self.qubits ]
+
+        # Build h x I, then permute the qubits into place.
+        M = _kron( self.matrix, identity( 2**( n - m ) ), format = 'csr' )
+        order = list( self.qubits ) + rest
+        index = argsort( transpose( arange( 2**n ).reshape( (2,) * n ), \
+                                    order ).flatten() )
+        return M[index][:,index]
+
+
+    def apply( self, psi ):
+        """
+        Applies self to a state vector, or to an array whose columns
+        are state vectors, without forming the matrix on the register.
+        """
+        psi = asarray( psi )
+        T = psi.reshape( (2,) * self.number_qubits + psi.shape[1:] )
+        return apply( T, self.qubits, self.matrix ).reshape( psi.shape )
+
+
+def is_local( hamiltonians ):
+    """
+    Returns True if hamiltonians is a non-empty list of local
+    operators on registers of the same size.
+    """
+    return len( hamiltonians ) > 0 and \
+           all( [ isinstance( h, local_operator ) for h in hamiltonians ] ) and \
+           len( set( [ h.number_qubits for h in hamiltonians ] ) ) == 1
+
+
+def apply( psi, qubits, matrix ):
+    """
+    Applies a small matrix to the named qubits of a state tensor.
+
+    **Forms:**
+
+       * ``apply( psi, qubits, matrix )``
+
+    **Args:**
+
+       * *psi* : A state tensor with one axis of length 2 for each
+         qubit, optionally followed by further axes, e.g. for a block
+         of states.
+       * *qubits* : The m qubits on which the matrix acts.
+       * *matrix* : A :math:`2^m \\times 2^m` matrix.
+
+    **Returns:**
+
+       * psi : The transformed state tensor, with the axis order of
+         the input.
+    """
+    qubits = list( qubits )
+    m = len( qubits )
+
+    U = asarray( matrix ).reshape( (2,) * ( 2 * m ) )
+    out = tensordot( U, psi, axes = ( range( m, 2 * m ), qubits ) )
+    return moveaxis( out, range( m ), qubits )
@@ -0,0 +1,346 @@
+# OPTIMIZE.PY
+#
+# Gradient based optimization of control functions
+#
+# Copyright (C) 2011, 2012 True Merrill
+# Georgia Institute of Technology
+# School of Chemistry and Biochemistry
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from quantop import *
+from numpy import einsum, matmul, asarray, diff, sinc, empty, real, dot, \
+     array_split, concatenate, meshgrid
+from numpy.linalg import eigh
+from numpy.polynomial.hermite_e import hermegauss
+from scipy.optimize import fmin_l_bfgs_b
+from multiprocessing import Pool
+import control
+import error
+import parametric
+import routines
+
+__all__ = ['grape','error_ensemble']
+
+
+def grape( ctrl, hamiltonians, target, metric = routines.infidelity, \
+           **keyword_args ):
+    """
+    Optimizes a set of control functions using the GRAPE algorithm
+    (gradient ascent pulse engineering).  The controls are treated as
+    piecewise constant over each time slice, as in the Trotter solver,
+    and every slice amplitude is a free parameter.
+
+    **Forms:**
+
+       * ``grape( ctrl, hamiltonians, target )``
+       * ``grape( ctrl, hamiltonians, target, metric )``
+       * ``grape( ctrl, hamiltonians, target, metric, maxiter = n )``
+       * ``grape( ctrl, hamiltonians, target, ensemble = errors )``
+
+    **Args:**
+
+       * *ctrl* : An instance of the control class.  Used as the
+         initial guess, and to supply the time slices.  For an
+         instance of the parametric class only the coefficients are
+         optimized.
+       * *hamiltonians* : A list or array of k-many Hamiltonians.
+       * *target* : The target unitary, a N x N matrix.
+       * *metric* : A distance measure from routines, called as
+         ``metric( target, U )``.  It is recorded for every iteration
+         for reporting only, and does not change the objective or
+         the stopping criteria.
+
+    **Optional keys:**
+
+       * maxiter = n : Maximum number of L-BFGS iterations.  The
+         default is 500.
+       * tol = x : Stop when the minimized infidelity, averaged over
+         the ensemble, falls below x.  The default is 1E-10.
+       * bounds = (lower, upper) : Bounds on the control amplitudes,
+         or on the coefficients of a parametric control.  By default
+         the amplitudes are unbounded.
+       * ensemble = errors : A list of error objects.  The pulse is
+         made robust by minimizing the weighted average of the
+         infidelity over the distorted controls.  See
+         ``error_ensemble()``.
+       * weights = w : Weights of the ensemble members.  By default
+         the members are weighted equally.
+       * processes = p : Number of worker processes used to share
+         the ensemble members.  By default the ensemble is evaluated
+         in the calling process.
+
+    **Returns:**
+
+       * [ctrl, history] : An optimized instance of the control
+         class, and an array of metric values for each iteration.
+         For ensembles the history holds the weighted average of the
+         metric.
+
+    The optimization minimizes the phase insensitive infidelity
+    :math:`1 - |\\mathrm{tr}( T^\\dagger U )|^2 / N^2`.  Exact
+    gradients for all slices are found in one forward and backward
+    sweep over prefix and suffix products of the slice propagators,
+    and the update uses the L-BFGS quasi-Newton method.  All members
+    of an ensemble share the same sweep, with the members stacked
+    along a leading axis.
+    """
+
+    maxiter = keyword_args.get( 'maxiter', 500 )
+    tol = keyword_args.get( 'tol', 1E-10 )
+    bounds = keyword_args.get( 'bounds', None )
+    ensemble = keyword_args.get( 'ensemble', None )
+    weights = keyword_args.get( 'weights', None )
+    processes = keyword_args.get( 'processes', None )
+
+    if not ctrl.number_controls == len(hamiltonians):
+        raise ValueError('Bilinear dimension mismatch.')
+
+    H = asarray( [ asarray(h, complex) for h in hamiltonians ] )
+    T = asarray( target, complex )
+    times = ctrl.times
+    dt = diff( times.flatten() )
+    shape = ( len(dt), ctrl.number_controls )
+
+    if ensemble is None:
+        weights = ones( 1 )
+
+    elif weights is None:
+        weights = ones( len(ensemble) ) / len(ensemble)
+
+    else:
+        weights = asarray( weights, float )
+        if not len(weights) == len(ensemble):
+            raise ValueError('Each ensemble member requires a weight.')
+
+    # For parametric controls the coefficients are optimized.
+    # Otherwise every control sample except the last one, which is
+    # not used by the solver, is a free parameter.
+    if isinstance( ctrl, parametric.parametric ):
+        x0 = ctrl.coefficients.flatten()
+
+        def ideal( x ):
+            return ctrl.update( x.reshape( ctrl.coefficients.shape ) )
+
+        def chain( c, g ):
+            return c.pullback( g ).flatten()
+
+    else:
+        x0 = asarray( ctrl.control[:-1,:], float ).flatten()
+
+        def ideal( x ):
+            u = x.reshape( shape )
+            return control.control( vstack(( u, u[-1:,:] )), times, \
+                                    interpolation = ctrl.interpolation, copy = False )
+
+        def chain( c, g ):
+            return g[:-1].flatten()
+
+    if bounds is not None:
+        bounds = [ bounds ] * len(x0)
+
+    def controls( x ):
+        # Ideal control for x, and the stack of slice controls seen by
+        # each ensemble member.
+        c = ideal( x )
+        if ensemble is None:
+            return [c, asarray( c.control, float )[None,:-1,:]]
+
+        distorted = [ asarray( err(c).control, float )[:-1,:] \
+                      for err in ensemble ]
+        for v in distorted:
+            if not v.shape == shape:
+                raise ValueError('Ensemble error models must preserve ' + \
+                                 'the time slices of the control.')
+        return [c, array( distorted )]
+
+    if processes is None:
+        evaluate = _infidelity
+
+    else:
+        pool = Pool( processes )
+        def evaluate( u, dt, H, T ):
+            chunks = array_split( u, min( processes, len(u) ) )
+            results = pool.map( _infidelity_star, \
+                                [ (c, dt, H, T) for c in chunks ] )
+            return [ concatenate( [ r[0] for r in results ] ), \
+                     concatenate( [ r[1] for r in results ] ) ]
+
+    def cost( x ):
+        [c, u] = controls( x )
+        [f, g] = evaluate( u, dt, H, T )
+
+        # Gradients with respect to the full sample arrays.  Pull the
+        # gradient of each member back onto the ideal controls.
+        g = concatenate( ( g, 0 * g[:,-1:,:] ), axis = 1 )
+        if ensemble is not None:
+            g = [ ensemble[i].pullback( c, g[i] ) \
+                  for i in range( len(ensemble) ) ]
+
+        return dot( weights, f ), chain( c, einsum( 'i,ijk->jk', weights, g ) )
+
+    # Record the metric after every iteration.  L-BFGS is stopped
+    # early by raising from the callback, once the objective itself
+    # is below tol, whatever metric is reported.
+    history = []
+    state = { 'x' : x0 }
+    N = T.shape[-1]
+
+    def callback( x ):
+        state['x'] = x.copy()
+        U = _propagate( controls(x)[1], dt, H )
+        history.append( dot( weights, \
+                             [ metric( target, operator(V) ) for V in U ] ) )
+        g = einsum( '...ii', matmul( T.conj().T, U ) )
+        if dot( weights, 1.0 - abs(g)**2 / N**2 ) < tol:
+            raise _Converged()
+
+    try:
+        callback( x0 )
+        [x, f, info] = fmin_l_bfgs_b( cost, x0, bounds = bounds, \
+                           maxiter = maxiter, factr = 10.0, pgtol = 1E-14, \
+                           callback = callback )
+        state['x'] = x
+
+    except _Converged:
+        pass
+
+    finally:
+        if processes is not None:
+            pool.close()
+            pool.join()
+
+    return [ideal( state['x'] ), array( history )]
+
+
+def error_ensemble( model, sigma, points = 5 ):
+    """
+    Constructs an ensemble of error objects for robust optimization.
+    The error parameters are assumed to be normally distributed, and
+    the members are placed at Gauss-Hermite quadrature nodes.
+
+    **Forms:**
+
+       * ``error_ensemble( model, sigma )``
+       * ``error_ensemble( model, sigma, points )``
+
+    **Args:**
+
+       * *model* : A string representing the name of the error model,
+         or an error object such as a composite_error.  For an error
+         object the nodes are placed on the joint parameter space,
+         using a product of one dimensional rules.
+       * *sigma* : Standard deviation of the error parameter, or a
+         list with one standard deviation per parameter.
+       * *points* : Number of quadrature nodes per parameter.
+
+    **Returns:**
+
+       * [errors, weights] : A list of error objects and an array of
+         quadrature weights, suitable for ``grape``.
+    """
+    [nodes, w] = hermegauss( points )
+    if not isinstance( model, error.error ):
+        return [ [ error.error( model, [ sigma * x ] ) for x in nodes ], \
+                 w / w.sum() ]
+
+    sigma = asarray( sigma, float ).flatten()
+    P = len( model.error_parameters )
+    if len( sigma ) == 1:
+        sigma = sigma.repeat( P )
+    if not len( sigma ) == P:
+        raise ValueError('Error model requires %i standard deviations.' %(P))
+
+    # Tensor product grid over the joint parameters.
+    grid = array( meshgrid( *( [ nodes ] * P ), indexing = 'ij' ) )
+    grid = grid.reshape( P, -1 ).T * sigma
+    weights = array( meshgrid( *( [ w ] * P ), indexing = 'ij' ) )
+    weights = weights.reshape( P, -1 ).prod( axis = 0 )
+
+    errors = []
+    for x in grid:
+        err = model.copy()
+        err.error_parameters = list( x )
+        errors.append( err )
+    return [errors, weights / weights.sum()]
+
+
+class _Converged( Exception ):
+    # Raised to stop the optimizer once the tolerance is reached.
+    pass
+
+
+def _slices( u, dt, H ):
+    # Eigen-decomposition of every slice Hamiltonian in one batched
+    # call, and the slice propagators exp(-i H_j dt_j).
+    G = einsum( '...jk,kab->...jab', u, H )
+    [w, V] = eigh( G )
+    e = exp( -1j * w * dt[:,None] )
+    Uj = matmul( V * e[...,None,:], V.conj().swapaxes(-1,-2) )
+    return [w, V, e, Uj]
+
+
+def _propagate( u, dt, H ):
+    # Time ordered product of the slice propagators.
+    Uj = _slices( u, dt, H )[3]
+    U = eye( H.shape[-1], dtype = complex )
+    for j in range( Uj.shape[-3] ):
+        U = matmul( Uj[...,j,:,:], U )
+    return U
+
+
+def _infidelity_star( args ):
+    # Helper for process pools, which only pass a single argument.
+    return _infidelity( *args )
+
+
+def _infidelity( u, dt, H, T ):
+    # Phase insensitive infidelity 1 - |tr(T^dagger U)|^2 / N^2 and
+    # its exact gradient with respect to every slice amplitude.  u may
+    # carry leading batch dimensions.
+    [w, V, e, Uj] = _slices( u, dt, H )
+    n = Uj.shape[-3]
+    N = H.shape[-1]
+
+    # Forward sweep, X_j = U_(j-1) ... U_0.
+    X = empty( Uj.shape, complex )
+    X[...,0,:,:] = eye( N )
+    for j in range( n - 1 ):
+        X[...,j+1,:,:] = matmul( Uj[...,j,:,:], X[...,j,:,:] )
+    U = matmul( Uj[...,n-1,:,:], X[...,n-1,:,:] )
+
+    # Backward sweep, Z_j = T^dagger U_(n-1) ... U_(j+1), so that
+    # tr(T^dagger dU) = tr(X_j Z_j dU_j).
+    Z = empty( Uj.shape, complex )
+    Z[...,n-1,:,:] = T.conj().T
+    for j in range( n - 1, 0, -1 ):
+        Z[...,j-1,:,:] = matmul( Z[...,j,:,:], Uj[...,j,:,:] )
+    P = matmul( X, Z )
+
+    # Derivative of each slice exponential in its eigenbasis.  The
+    # divided differences of exp(-i w dt) are written with sinc so
+    # that degenerate eigenvalues need no special treatment.
+    x = w * dt[:,None]
+    gamma = exp( -0.5j * ( x[...,:,None] + x[...,None,:] ) ) * \
+            sinc( ( x[...,:,None] - x[...,None,:] ) / (2*pi) )
+    Vh = V.conj().swapaxes(-1,-2)
+    Y = matmul( matmul( Vh, P ), V ).swapaxes(-1,-2) * gamma
+    K = matmul( matmul( V.conj(), Y ), V.swapaxes(-1,-2) )
+    dg = -1j * dt[:,None] * einsum( 'kab,...nab->...nk', H, K )
+
+    g = einsum( '...ii', matmul( T.conj().T, U ) )
+    cost = 1.0 - abs(g)**2 / N**2
+    grad = - 2.0 * real( g.conj()[...,None,None] * dg ) / N**2
+
+    return [cost, grad]
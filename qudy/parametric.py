@@ -0,0 +1,247 @@
+# PARAMETRIC.PY
+#
+# Control functions described by a small set of coefficients
+#
+# Copyright (C) 2011, 2012 True Merrill
+# Georgia Institute of Technology
+# School of Chemistry and Biochemistry
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from quantop import *
+from numpy import asarray, dot, diff, outer, allclose, concatenate
+from numpy import add as _add
+from numpy.fft import fft, ifft
+from scipy.interpolate import BSpline
+from control import control
+
+__all__ = ['parametric']
+
+
+class parametric( control ):
+    """
+    class for control functions described by a set of coefficients
+    in a Fourier or B-spline basis.  This is the usual description of
+    pulses in CRAB style optimization.
+
+    The samples on the time grid are produced from the coefficients,
+    so a parametric instance may be used anywhere a control instance
+    is accepted.
+
+    **Forms:**
+
+       * ``parametric( coefficients, t_arr )``
+       * ``parametric( coefficients, t_arr, basis = 'fourier' )``
+       * ``parametric( coefficients, t_arr, basis = 'fourier', frequencies = w )``
+       * ``parametric( coefficients, t_arr, basis = 'spline', degree = 3 )``
+
+    **Args:**
+
+       * *coefficients* : An (m, k) array.  Each column holds the
+         coefficients of one of the k control functions.
+       * *t_arr* : An n-element object of real-valued time values.
+
+    **Optional keys:**
+
+       * basis = 'method' : Chooses the basis functions.
+
+          1.  'fourier' : :math:`u(t) = \\sum_j a_j \\cos \\omega_j t +
+              b_j \\sin \\omega_j t`.  The first half of the rows of
+              *coefficients* hold the :math:`a_j` and the second half
+              the :math:`b_j`.
+          2.  'spline' : Clamped B-splines with uniformly spaced knots.
+
+       * frequencies = w : Frequencies of the Fourier basis, measured
+         from the first time value.  By default these are the
+         harmonics :math:`\\omega_j = 2 \\pi j / T`.  Random
+         frequencies give the CRAB basis.
+       * degree = n : Degree of the B-splines.  The default is 3.
+       * interpolation, verbose : See the control class.
+
+    For harmonic frequencies on a uniform grid, the samples are found
+    with an FFT.  Otherwise they are found from one product with the
+    basis matrix.  The samples are linear in the coefficients, so
+    their derivatives are exact, see ``jacobian()`` and
+    ``pullback()``.
+    """
+
+    def __init__( self, coefficients, t_arr, **keyword_args ):
+        """Initialize the parametric instance."""
+
+        coefficients = asarray( coefficients, float )
+        if len( coefficients.shape ) == 1:
+            coefficients = coefficients.reshape( (len(coefficients), 1) )
+
+        self.coefficients = coefficients
+        self.basis = keyword_args.get( 'basis', 'fourier' )
+        self.degree = keyword_args.get( 'degree', 3 )
+        self.frequencies = keyword_args.get( 'frequencies', None )
+
+        if self.basis == 'fourier':
+            if not coefficients.shape[0] % 2 == 0:
+                raise ValueError('Fourier coefficients require an even ' + \
+                                 'number of rows.')
+
+        elif self.basis == 'spline':
+            if coefficients.shape[0] <= self.degree:
+                raise ValueError('Spline basis requires more than %i ' \
+                                 %(self.degree) + 'coefficients.')
+
+        else:
+            raise ValueError('Basis %s not understood.' %(self.basis))
+
+        # Define the basis over the time interval of t_arr.  Samples
+        # on other grids use the same basis functions.
+        t = asarray( t_arr, float ).flatten()
+        self.origin = t[0]
+        self.period = t[-1] - t[0]
+        if self.basis == 'fourier' and self.frequencies is None:
+            m = coefficients.shape[0] // 2
+            self.harmonics = True
+            self.frequencies = 2 * pi * arange( m ) / self.period
+        else:
+            self.harmonics = False
+        if self.frequencies is not None:
+            self.frequencies = asarray( self.frequencies, float )
+
+        control.__init__( self, self.sample( t ), t_arr, **keyword_args )
+
+
+    def copy( self ):
+        """
+        Creates an independent copy of self in memory.
+        """
+        return self.update( self.coefficients.copy() )
+
+
+    def update( self, coefficients ):
+        """
+        Returns a parametric instance with new coefficients and the
+        same basis and time grid as self.
+        """
+        frequencies = None if self.harmonics else self.frequencies
+        return parametric( coefficients, self.times, basis = self.basis, \
+                        degree = self.degree, frequencies = frequencies, \
+                        interpolation = self.interpolation, verbose = self.verbose )
+
+
+    def inverse( self ):
+        """
+        function to invert controls.  The inverse is returned as an
+        ordinary control instance.  See ``control.inverse()``.
+        """
+        c = control( self.control, self.times )
+        c.interpolation = self.interpolation
+        c.verbose = self.verbose
+        return c.inverse()
+
+
+    def sample( self, times ):
+        """
+        Evaluates the control functions on an array of times.
+
+        **Args:**
+
+           * *times* : An n-element array of time values.
+
+        **Returns:**
+
+           * arr : An (n, k) array of control values.
+        """
+        t = asarray( times, float ).flatten()
+
+        if self.harmonics and len(t) > 2 and _uniform( t ) and \
+               allclose( t[-1] - t[0], self.period ) and \
+               allclose( t[0], self.origin ):
+
+            # Harmonic frequencies on a uniform grid that spans the
+            # period.  Sum the spectrum with one inverse FFT.
+            m = len( self.frequencies )
+            L = len(t) - 1
+            spectrum = zeros( (L, self.coefficients.shape[1]), complex )
+            _add.at( spectrum, arange( m ) % L, \
+                     self.coefficients[0:m] - 1j * self.coefficients[m:] )
+            arr = real( L * ifft( spectrum, axis = 0 ) )
+            return vstack(( arr, arr[0:1] ))
+
+        return dot( self.jacobian( t ), self.coefficients )
+
+
+    def jacobian( self, times = None ):
+        """
+        Derivative of the samples with respect to the coefficients.
+        The same basis matrix applies to every control function.
+
+        **Args:**
+
+           * *times* : An n-element array of time values.  By default
+             the time grid of self is used.
+
+        **Returns:**
+
+           * B : An (n, m) array, such that ``self.control = dot( B,
+             self.coefficients )``.
+        """
+        if times is None:
+            times = self.times
+        t = asarray( times, float ).flatten()
+
+        if self.basis == 'fourier':
+            wt = outer( t - self.origin, self.frequencies )
+            return hstack(( cos( wt ), sin( wt ) ))
+
+        # Clamped knot vector with uniformly spaced interior knots.
+        m = self.coefficients.shape[0]
+        p = self.degree
+        knots = concatenate(( [self.origin] * p, \
+                self.origin + self.period * arange( m - p + 1 ) / float( m - p ), \
+                [self.origin + self.period] * p ))
+        return BSpline( knots, eye( m ), p )( t )
+
+
+    def pullback( self, gradient ):
+        """
+        Maps a gradient taken with respect to the samples onto the
+        coefficients.
+
+        **Args:**
+
+           * *gradient* : An (n, k) array with the shape of
+             ``self.control``.
+
+        **Returns:**
+
+           * An (m, k) array with the shape of ``self.coefficients``.
+        """
+        g = asarray( gradient, float )
+        t = self.times.flatten()
+
+        if self.harmonics and len(t) > 2 and _uniform( t ):
+
+            # The last sample coincides with the first one modulo the
+            # period.  Use an FFT for the transposed sum.
+            m = len( self.frequencies )
+            L = len(t) - 1
+            h = g[0:L].copy()
+            h[0] = h[0] + g[L]
+            G = fft( h, axis = 0 )[ arange( m ) % L ]
+            return vstack(( real( G ), - imag( G ) ))
+
+        return dot( self.jacobian().T, g )
+
+
+def _uniform( t ):
+    # Check that a time grid has uniform spacing.
+    dt = diff( t )
+    return allclose( dt, dt[0], rtol = 1E-10, atol = 0 )
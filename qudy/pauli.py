@@ -0,0 +1,487 @@
+# PAULI.PY
+#
+# Symbolic algebra of Pauli strings
+#
+# Copyright (C) 2011, 2012 True Merrill
+# Georgia Institute of Technology
+# School of Chemistry and Biochemistry
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from quantop import *
+from quantop import operator
+from numpy import log, asarray, argsort, searchsorted, uint64, int64, nonzero, \
+     where, bitwise_and, bitwise_xor, right_shift
+from scipy.sparse import csr_matrix
+
+__all__ = ['pauli','pauli_basis']
+
+# Powers of i, indexed by the phase exponent.
+_POWERS = array([ 1, 1j, -1, -1j ])
+
+
+class pauli( object ):
+    """
+    class for Pauli strings.  A Pauli string on n qubits is stored as
+    two bit masks and a phase,
+
+    .. math::
+
+       P = s \\, i^k \\prod_j i^{x_j z_j} X_j^{x_j} Z_j^{z_j},
+
+    so that each factor is one of I, X, Y or Z.  Products and
+    commutators of Pauli strings are again Pauli strings, and are found
+    with a few bitwise operations on the masks.  Matrices are only
+    formed on request, see ``dense()`` and ``sparse()``.
+
+    **Forms:**
+
+       * ``pauli( label )``
+       * ``pauli( label, scale = s )``
+       * ``pauli( x, z, number_qubits )``
+
+    **Args:**
+
+       * *label* : A string of the characters 'I', 'X', 'Y' and 'Z',
+         one per qubit, e.g. ``'XIZ'``.  The first character acts on
+         the first tensor factor.
+       * *x*, *z* : Integer bit masks.  Bit j refers to qubit j.
+       * *number_qubits* : Number of qubits.
+
+    **Optional keys:**
+
+       * scale = s : Real scale factor.  The default is 1.
+       * phase = k : Phase :math:`i^k`.  The default is 0.
+
+    The dense matrix is also returned by ``asarray( P )``.  The
+    functions ``routines.product_operator``, ``routines.commutator``,
+    ``routines.generate_algebra`` and ``routines.structure_constants``
+    accept Pauli strings and then work on the masks alone.
+    """
+
+    # Let numpy scalars defer to __rmul__.
+    __array_priority__ = 20
+
+    def __init__( self, *args, **keyword_args ):
+        """Initialize the pauli instance."""
+
+        if len( args ) == 1 and isinstance( args[0], str ):
+            label = args[0].upper()
+            [x, z] = [0, 0]
+            for (j, c) in enumerate( label ):
+                if not c in 'IXYZ':
+                    raise ValueError('Pauli label %s not understood.' %(label))
+                if c in 'XY':
+                    x = x | ( 1 << j )
+                if c in 'YZ':
+                    z = z | ( 1 << j )
+            number_qubits = len( label )
+
+        elif len( args ) == 3:
+            [x, z, number_qubits] = [ int( a ) for a in args ]
+
+        else:
+            raise SyntaxError("Improper number of arguments.")
+
+        self.x = x
+        self.z = z
+        self.number_qubits = number_qubits
+        self.phase = keyword_args.get( 'phase', 0 ) % 4
+        self.scale = float( keyword_args.get( 'scale', 1.0 ) )
+
+
+    def __repr__( self ):
+        """
+        Function to display pauli objects when called on the command
+        line.
+        """
+        sign = ['+', '+i', '-', '-i'][self.phase]
+        return '%s%g %s' %( sign, self.scale, self.label() )
+
+
+    def __eq__( self, P ):
+        if not isinstance( P, pauli ):
+            return False
+        return self.key() == P.key() and \
+               abs( self.coefficient() - P.coefficient() ) <= \
+               1E-12 * max( abs( self.scale ), abs( P.scale ) )
+
+
+    def __ne__( self, P ):
+        return not self.__eq__( P )
+
+
+    def __mul__( self, P ):
+        """
+        Product of two Pauli strings, or of a Pauli string and a
+        number.
+        """
+        if isinstance( P, pauli ):
+            return _product( self, P )
+
+        # Multiplication by a number.  Factors of i enter the phase.
+        c = complex( P )
+        if c == 0:
+            return self.copy( scale = 0.0 )
+        for k in range( 4 ):
+            r = c / _POWERS[k]
+            if abs( r.imag ) <= 1E-12 * abs( c ) and r.real > 0:
+                return self.copy( phase = self.phase + k, \
+                                  scale = self.scale * r.real )
+        raise ValueError('Pauli strings may only be scaled by real ' + \
+                         'multiples of powers of i.')
+
+
+    def __rmul__( self, c ):
+        return self.__mul__( c )
+
+
+    def __div__( self, c ):
+        return self.__mul__( 1.0 / c )
+
+    __truediv__ = __div__
+
+
+    def __neg__( self ):
+        return self.copy( phase = self.phase + 2 )
+
+
+    def __array__( self, dtype = None ):
+        if dtype is None:
+            return asarray( self.dense() )
+        return asarray( self.dense(), dtype )
+
+
+    def copy( self, **keyword_args ):
+        """
+        Creates a copy of self.  The keys phase and scale replace the
+        corresponding values.
+        """
+        return pauli( self.x, self.z, self.number_qubits, \
+                      phase = keyword_args.get( 'phase', self.phase ), \
+                      scale = keyword_args.get( 'scale', self.scale ) )
+
+
+    def key( self ):
+        """
+        Returns the bit masks (x, z), which identify the string up to
+        its phase and scale.
+        """
+        return (self.x, self.z)
+
+
+    def label( self ):
+        """
+        Returns the string of Pauli factors, e.g. 'XIZ'.
+        """
+        return ''.join( [ 'IZXY'[ ( (self.x >> j) & 1 ) * 2 + ( (self.z >> j) & 1 ) ] \
+                          for j in range( self.number_qubits ) ] )
+
+
+    def coefficient( self ):
+        """
+        Returns the complex factor :math:`s \\, i^k`.
+        """
+        return self.scale * _POWERS[ self.phase ]
+
+
+    def commutes( self, P ):
+        """
+        Returns True when self commutes with the Pauli string P.
+        """
+        return _parity( ( self.x & P.z ) ^ ( self.z & P.x ) ) == 0
+
+
+    def commutator( self, P ):
+        """
+        Commutator :math:`[A, B] = AB - BA` of two Pauli strings.  The
+        result is a Pauli string, with zero scale when the strings
+        commute.
+        """
+        if self.commutes( P ):
+            return self.copy( scale = 0.0 )
+        return 2 * _product( self, P )
+
+
+    def dense( self ):
+        """
+        Returns the matrix of self as an operator.
+        """
+        return operator( self.sparse().toarray() )
+
+
+    def sparse( self ):
+        """
+        Returns the matrix of self as a scipy.sparse csr_matrix.  Each
+        Pauli string has a single non-zero element per column.
+        """
+        n = self.number_qubits
+        N = 2**n
+
+        # Masks on the basis state index, where the first qubit is
+        # the most significant bit.
+        x = _reverse( self.x, n )
+        z = _reverse( self.z, n )
+        c = arange( N, dtype = int64 )
+        sign = 1 - 2 * _parities( bitwise_and( c, z ) )
+        value = self.coefficient() * _POWERS[ _count( self.x & self.z ) % 4 ] * sign
+        return csr_matrix( ( value, ( bitwise_xor( c, x ), c ) ), shape = (N, N) )
+
+
+def pauli_basis( number_qubits, scale = 0.5 ):
+    """
+    Returns the :math:`4^n - 1` non-trivial Pauli strings on n
+    qubits, in the order used by ``routines.product_operator``.
+
+    **Args:**
+
+       * *number_qubits* : Number of qubits.
+       * *scale* : Scale of every string.  The default of 0.5 gives
+         the product operators.
+
+    **Returns:**
+
+       * A list of pauli instances.
+    """
+    n = int( number_qubits )
+    basis = []
+    for j in range( 1, 4**n ):
+        [x, z] = [0, 0]
+        for k in range( n ):
+            index = ( j >> (2*k) ) & 3
+            if index in (1, 2):
+                x = x | ( 1 << k )
+            if index in (2, 3):
+                z = z | ( 1 << k )
+        basis.append( pauli( x, z, n, scale = scale ) )
+    return basis
+
+
+def from_matrix( M, tol = 1E-12 ):
+    """
+    Recognizes a scaled Pauli string from its matrix.
+
+    **Args:**
+
+       * *M* : A :math:`2^n \\times 2^n` matrix.
+       * *tol* : Absolute tolerance on the matrix elements.
+
+    **Returns:**
+
+       * A pauli instance, or None when M is not a real multiple of a
+         power of i times a Pauli string.
+    """
+    M = asarray( M, complex )
+    N = M.shape[0]
+    n = int( round( log( N ) / log( 2 ) ) ) if N > 0 else 0
+    if not M.shape == (N, N) or not 2**n == N:
+        return None
+
+    # The column of the first basis state fixes the x mask, and the
+    # signs along the permutation fix the z mask.
+    c = arange( N, dtype = int64 )
+    row = int( abs( M[:,0] ).argmax() )
+    d = M[ bitwise_xor( c, row ), c ]
+    if abs( d[0] ) <= tol:
+        return None
+    z = 0
+    for b in range( n ):
+        if ( d[ 1 << b ] / d[0] ).real < 0:
+            z = z | ( 1 << b )
+    sign = 1 - 2 * _parities( bitwise_and( c, z ) )
+    if abs( d - d[0] * sign ).max() > tol or \
+       abs( abs( M ).sum() - N * abs( d[0] ) ) > N * tol:
+        return None
+
+    x = _reverse( row, n )
+    z = _reverse( z, n )
+    P = pauli( x, z, n )
+    try:
+        return P * complex( d[0] / _POWERS[ _count( x & z ) % 4 ] )
+    except ValueError:
+        return None
+
+
+def is_pauli( hamiltonians ):
+    """
+    Returns True when every element of a list is a Pauli string on the
+    same number of qubits.
+    """
+    return len( hamiltonians ) > 0 and \
+           all( [ isinstance( h, pauli ) for h in hamiltonians ] ) and \
+           len( set( [ h.number_qubits for h in hamiltonians ] ) ) == 1
+
+
+def generate_algebra( hamiltonians ):
+    """
+    Pauli string version of ``routines.generate_algebra``.  Every
+    commutator of two Pauli strings is proportional to a Pauli string,
+    so the algebra is closed by a search over strings, using
+    commutation checks on the masks.
+
+    **Returns:**
+
+       * A list of skew-Hermitian Pauli strings, orthonormal in the
+         Hilbert-Schmidt inner product.
+    """
+    n = hamiltonians[0].number_qubits
+    seeds = []
+    for h in hamiltonians:
+        if h.scale != 0 and not h.key() in [ s.key() for s in seeds ]:
+            seeds.append( h )
+
+    found = set( [ h.key() for h in seeds ] )
+    algebra = seeds[:]
+    index = 0
+    while index < len( algebra ):
+        a = algebra[index]
+        for g in seeds:
+            if not a.commutes( g ):
+                c = _product( a, g )
+                if not c.key() in found:
+                    found.add( c.key() )
+                    algebra.append( c )
+        index = index + 1
+
+    norm = 1.0 / sqrt( 2.0**n )
+    return [ pauli( a.x, a.z, n, phase = 3, scale = norm ) for a in algebra ]
+
+
+def structure_constants( hamiltonians, sparse = False ):
+    """
+    Pauli string version of ``routines.structure_constants``.  Finds
+    :math:`f_{abc}` with :math:`-i [H_a, H_b] = \\sum_c f_{abc} H_c`.
+    For Pauli strings each pair (a, b) has at most one non-zero
+    constant.
+
+    **Raises:**
+
+       * ``ValueError`` : The Hamiltonians are not closed under
+         commutation.
+    """
+    m = len( hamiltonians )
+    n = hamiltonians[0].number_qubits
+    keys = [ h.key() for h in hamiltonians ]
+    if len( set( keys ) ) < m:
+        raise ValueError('Hamiltonians must be linearly independent.')
+
+    if 2*n <= 62:
+        # All pairs at once, on 64 bit masks.
+        x = array( [ h.x for h in hamiltonians ], dtype = int64 )
+        z = array( [ h.z for h in hamiltonians ], dtype = int64 )
+        anti = _parities( bitwise_xor( bitwise_and( x[:,None], z[None,:] ), \
+                                       bitwise_and( z[:,None], x[None,:] ) ) )
+        [a, b] = nonzero( anti )
+        x3 = bitwise_xor( x[a], x[b] )
+        z3 = bitwise_xor( z[a], z[b] )
+
+        # Locate the products among the Hamiltonians.
+        combined = ( x << n ) | z
+        order = argsort( combined )
+        key = ( x3 << n ) | z3
+        position = _clip_index( searchsorted( combined[order], key ), m )
+        c = order[ position ]
+        if not ( combined[c] == key ).all():
+            raise ValueError('Hamiltonians are not closed under commutation.')
+
+        phase = _counts( bitwise_and( x[a], z[a] ) ) + \
+                _counts( bitwise_and( x[b], z[b] ) ) + \
+                2 * _counts( bitwise_and( z[a], x[b] ) ) - \
+                _counts( bitwise_and( x3, z3 ) )
+        p = asarray( [ h.phase for h in hamiltonians ] )
+        s = asarray( [ h.scale for h in hamiltonians ] )
+        coef = _POWERS[ ( phase + p[a] + p[b] - p[c] ) % 4 ] * \
+               2 * s[a] * s[b] / s[c]
+
+    else:
+        lookup = dict( [ (k, i) for (i, k) in enumerate( keys ) ] )
+        [a, b, c, coef] = [ [], [], [], [] ]
+        for i in range( m ):
+            for j in range( m ):
+                A = hamiltonians[i]
+                B = hamiltonians[j]
+                if A.commutes( B ):
+                    continue
+                C = _product( A, B )
+                if not C.key() in lookup:
+                    raise ValueError('Hamiltonians are not closed under ' + \
+                                     'commutation.')
+                k = lookup[ C.key() ]
+                a.append( i )
+                b.append( j )
+                c.append( k )
+                coef.append( 2 * C.coefficient() / hamiltonians[k].coefficient() )
+        [a, b, c, coef] = [ asarray( a, int ), asarray( b, int ), \
+                            asarray( c, int ), asarray( coef, complex ) ]
+
+    # -i [H_a, H_b] = -i coef H_c
+    f = real( -1j * coef )
+    if sparse:
+        return [ array( [ a, b, c ], dtype = int ).T.reshape( -1, 3 ), f ]
+
+    F = zeros( (m, m, m) )
+    F[ a, b, c ] = f
+    return F
+
+
+def _clip_index( index, m ):
+    # Keep search results inside the array.
+    return where( index < m, index, m - 1 )
+
+
+def _product( A, B ):
+    # Product of two Pauli strings.  With P(x,z) = i^(x.z) X^x Z^z,
+    # P(x1,z1) P(x2,z2) = i^(x1.z1 + x2.z2 + 2 z1.x2 - x3.z3) P(x3,z3).
+    if not A.number_qubits == B.number_qubits:
+        raise ValueError('Pauli strings act on different numbers of qubits.')
+    x = A.x ^ B.x
+    z = A.z ^ B.z
+    phase = A.phase + B.phase + _count( A.x & A.z ) + _count( B.x & B.z ) + \
+            2 * _count( A.z & B.x ) - _count( x & z )
+    return pauli( x, z, A.number_qubits, phase = phase % 4, \
+                  scale = A.scale * B.scale )
+
+
+def _count( v ):
+    # Number of set bits of an integer.
+    return bin( v ).count('1')
+
+
+def _parity( v ):
+    # Parity of the number of set bits of an integer.
+    return _count( v ) & 1
+
+
+def _counts( v ):
+    # Number of set bits of every element of an int64 array.
+    v = asarray( v, int64 ).astype( uint64 )
+    v = v - ( right_shift( v, uint64(1) ) & uint64(0x5555555555555555) )
+    v = ( v & uint64(0x3333333333333333) ) + \
+        ( right_shift( v, uint64(2) ) & uint64(0x3333333333333333) )
+    v = ( v + right_shift( v, uint64(4) ) ) & uint64(0x0F0F0F0F0F0F0F0F)
+    return right_shift( v * uint64(0x0101010101010101), uint64(56) ).astype( int64 )
+
+
+def _parities( v ):
+    # Parity of the number of set bits of every element of an array.
+    return _counts( v ) & 1
+
+
+def _reverse( v, n ):
+    # Reverse the order of the lowest n bits of an integer.
+    r = 0
+    for j in range( n ):
+        if ( v >> j ) & 1:
+            r = r | ( 1 << (n - 1 - j) )
+    return r
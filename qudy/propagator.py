@@ -20,10 +20,15 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from quantop import *
+from numpy import einsum, asarray, outer
+from numpy.linalg import lstsq
 import control
 import integration
 import routines
 import imperfect
+import su2
+import hamiltonian_set
+import local_operator
 
 
 __all__ = ['propagator','rotation','R']
@@ -40,9 +45,11 @@ class propagator:
     x N matrices, where N is the dimensionality of the Hilbert space.
     If no Lindblad channels are specified, then the evolution is
     assumed to be unitary.  If no Hamiltonians are specified and the
-    dimensionality of the control system is n(n-1), then we assume the
-    dynamical Lie algebra is SU(2^n) and use a product-operator basis
-    for the
+    dimensionality of the control system is :math:`4^n - 1`, then we
+    assume the dynamical Lie algebra is SU(2^n) and use a
+    product-operator basis for the Hamiltonians.  Otherwise, if it is
+    :math:`d^2 - 1`, we assume a single d-level system and use the
+    generalized Gell-Mann matrices, see ``routines.gell_mann()``.
     
     **Forms:**
     
@@ -50,6 +57,7 @@ class propagator:
        * ``propagator(ctrl, hamiltonians)``
        * ``propagator(ctrl, hamiltonians, solution = 'method')``
        * ``propagator(ctrl, hamiltonians, solution = 'method', order = n)``
+       * ``propagator(ctrl, hamiltonians, drift = H0)``
     
     **Args:**
       
@@ -58,7 +66,9 @@ class propagator:
        * *hamiltonians* :  A list or array of k-many Hamiltonians.  
          The Hamiltonians must be square matrices of the same 
          dimensionality.  It is recommended to use the operator 
-         class.
+         class.  scipy.sparse matrices are accepted for large
+         registers, see ``evolve()``.  The Hamiltonians are stored as
+         a hamiltonian_set, except for lists of local operators.
     
     **Optional keywords:**
     
@@ -70,7 +80,30 @@ class propagator:
             2. 'dyson' : Dyson series.
             3. 'magnus' : Magnus expansion.
             4. 'lindblad' : Lindblad master equation.
+            5. 'adjoint' : Trotter method in the adjoint
+               representation of the dynamical Lie algebra.  See
+               ``adjoint()``.  The unitary is recovered only when the
+               algebra acts irreducibly, otherwise a ValueError is
+               raised.
+            6. 'interaction' : Solves in the interaction picture of
+               the drift Hamiltonian, see
+               ``integration.interaction()``.  This is the default
+               when a drift is given.
+            7. 'midpoint', 'yoshida', 'cfm4' : Second and fourth
+               order splitting methods, which evaluate the controls
+               between samples with the interpolation method of the
+               control.  See ``integration.splitting()``.
+            8. 'adaptive' : Fourth order method with error controlled
+               steps, see ``integration.adaptive()``.
             
+       * drift = H0 : A static drift Hamiltonian, so that the
+         generator is :math:`H_0 + \sum_\mu u_\mu(t) H_\mu`.  Methods
+         other than 'interaction' treat the drift as an additional
+         Hamiltonian with a constant control of 1.
+       * tolerance = float : Tolerance on the error of U for the
+         adaptive method.  The default is 1e-8.
+       * threads = n : Number of threads used by the Trotter method,
+         see ``integration.trotter()``.  The default is 1.
        * order = n : Integer valued order of pertubaton theory.  Used in 
          the Dyson and Magnus methods
        * integration_method = 'method' : Integration technique used in 
@@ -91,31 +124,40 @@ class propagator:
     def __init__(self, *args, **keyword_args):
         
         # If there is one argument, then the user only gave a control
-        # function.  Assume a qubit system, i.e. SU(2^n).
+        # function.  Assume a qubit system, i.e. SU(2^n), or else a
+        # single qudit, i.e. SU(d).
         if len(args) == 1:
             self.ideal_control = args[0]
             dim = self.ideal_control.number_controls
                 
-            # Convert Lie dimensonality into number of qubits.
+            # Convert Lie dimensonality into number of qubits, or into
+            # the number of levels.
             n = log( dim + 1 ) / log( 4 )
-            self.number_qubits = n
-            self.lie_algebra = "su(%i)" %(int(2**n))
-            if n == 1:
-                self.hamiltonians = [Hx,Hy,Hz]
+            d = int( round( sqrt( dim + 1 ) ) )
+            if abs( n - round( n ) ) < 1E-9:
+                self.number_qubits = int( round( n ) )
+                self.lie_algebra = "su(%i)" %( 2**self.number_qubits )
+                self.hamiltonians = routines.product_operator( n, \
+                                                       representation = 'set' )
+            elif d**2 == dim + 1:
+                self.lie_algebra = "su(%i)" %( d )
+                self.hamiltonians = routines.gell_mann( d, \
+                                                    representation = 'set' )
             else:
-                self.hamiltonians = routines.product_operator( n )
+                raise ValueError('Hamiltonians are required for %i ' %( dim ) + \
+                                 'controls.')
             
         # If there are two arguments, then the user gave both a set of
         # controls and also a set of Hamiltonians.
         elif len(args) == 2:
             self.ideal_control = args[0]
-            self.hamiltonians = args[1]
+            self.hamiltonians = _hamiltonians( args[1] )
             
         # If there are three arguments, then the user gave controls,
         # Hamiltonians and Lindblad operators.
         elif len(args) == 3:
             self.ideal_control = args[0]
-            self.hamiltonians = args[1]
+            self.hamiltonians = _hamiltonians( args[1] )
             self.lindblad = args[2]
             
             # Since Lindblad operators were specified, we should use
@@ -134,8 +176,14 @@ class propagator:
         
         # Create an control.  For propagator instances, these are
         # identical to ideal_control, however for imperfect instances
-        # these differ.
-        self.control = self.ideal_control.copy()
+        # these differ.  Control arrays are read-only, so the instance
+        # is shared.
+        self.control = self.ideal_control
+
+        # Static drift Hamiltonian, if any.
+        self.drift = keyword_args.get( 'drift', None )
+        if self.drift is not None:
+            self.drift = operator( self.drift )
         
         # Parse through keyword arguments.  Sets default solution
         # method.  Other keywords that are not understood will be
@@ -143,7 +191,9 @@ class propagator:
         if keyword_args.has_key( 'solution' ):
             
             method = keyword_args['solution']
-            valid_inputs = ['trotter', 'dyson', 'magnus', 'lindblad']
+            valid_inputs = ['trotter', 'dyson', 'magnus', 'lindblad', \
+                            'adjoint', 'interaction', 'midpoint', \
+                            'yoshida', 'cfm4', 'adaptive']
             
             if method in valid_inputs:
                 self.solution_method = method
@@ -155,6 +205,8 @@ class propagator:
                 # Return to default and warn user
                 self.solution_method = 'trotter'
                 warn('Solution method not understood, defaulting to \'trotter\'.')
+        elif self.drift is not None:
+            self.solution_method = 'interaction'
         else:
             # set default solution method
             self.solution_method = 'trotter'
@@ -182,6 +234,12 @@ class propagator:
         else:
             # Set default order
             self.order = default_order
+
+        # Tolerance of the adaptive solver.
+        self.tolerance = float( keyword_args.get( 'tolerance', 1e-8 ) )
+
+        # Number of threads of the Trotter solver.
+        self.threads = keyword_args.get( 'threads', 1 )
             
                        
     def __repr__(self):
@@ -203,12 +261,13 @@ class propagator:
         """
         
         def H_check( h1, h2 ):
-            # Cleverly uses a method in the operator class to
-            # determine if Hamiltonians are identical.
+            # Hamiltonian sets compare by their fingerprints, so the
+            # check does not depend on the size of the Hamiltonians.
             return h1 == h2
         
         try:
-            if H_check( self.hamiltonians , target.hamiltonians ):
+            if H_check( self.hamiltonians , target.hamiltonians ) and \
+                   _same_drift( self.drift, target.drift ):
                 
                 # Hamiltonians match, append controls together
                 ctrl1 = target.ideal_control.control
@@ -232,7 +291,7 @@ class propagator:
                 ARR = hstack( (ctrl0, t) )
                 
             else:
-                raise ValueError('Hamiltonians do not match. ' +\
+                raise ValueError('Hamiltonians or drifts do not match. ' +\
                       'Multiplication is ill-defined.')
         
         except AttributeError:
@@ -243,11 +302,13 @@ class propagator:
             # Check if target is an imperfect propagator.  If it is,
             # we should default to returning an imperfect propagator.
             return imperfect.imperfect( control.control(ARR) , \
-                               self.hamiltonians, target.error )
+                               self.hamiltonians, target.error, \
+                               drift = self.drift )
         
         else:
             # Must be a normal propagator.
-            return propagator( control.control(ARR) , self.hamiltonians )
+            return propagator( control.control(ARR) , self.hamiltonians, \
+                               drift = self.drift )
 
     
     def __call__(self, time = None):
@@ -276,7 +337,12 @@ class propagator:
         ARR = hstack( (arr,times) )
         
         # Form new propagator
-        U = propagator( control.control( ARR ) )
+        ctrl = control.control( ARR, \
+                                interpolation = self.control.interpolation )
+        U = propagator( ctrl, self.hamiltonians, drift = self.drift )
+        U.solution_method = self.solution_method
+        U.tolerance = self.tolerance
+        U.threads = self.threads
         
         # Solve propagator
         return U.solve()
@@ -287,11 +353,13 @@ class propagator:
         Creates an independent copy of self in memory.
         """
         
+        # Hamiltonian sets are immutable and are shared.
         ctrl = self.control.copy()
-        hamiltonians = self.hamiltonians[:]
-        c = propagator( ctrl, hamiltonians )
+        c = propagator( ctrl, self.hamiltonians, drift = self.drift )
         c.solution_method = str( copy( self.solution_method ) )
         c.order = int( copy( self.order ) )
+        c.tolerance = self.tolerance
+        c.threads = self.threads
         
         return c
 
@@ -310,33 +378,54 @@ class propagator:
         # Create copy of self
         c = self.copy()
         
-        # Replace c.control with inverse controls
+        # Replace c.control with inverse controls.  A drift is
+        # reversed by changing its sign.
         c.control = ctrl
         c.ideal_control = ctrl
+        if c.drift is not None:
+            c.drift = - c.drift
         
         return c
         
     
-    def solve(self, method = 'trotter'):
+    def solve(self, method = None):
         """
-        
+        Solves the control problem.  By default ``self.solution_method``
+        is used, see the class documentation for the methods.
         """
+        if method is None:
+            method = self.solution_method
+
+        if method == 'interaction':
+            drift = self.drift
+            if drift is None:
+                drift = zeros( (self.hamiltonians[0].shape) )
+            return integration.interaction( self.control, \
+                self.hamiltonians, drift )
+
+        [ctrl, hamiltonians] = self._bilinear()
         
         if method == 'trotter':
-            U = integration.trotter( self.control, \
-                self.hamiltonians )
+            U = integration.trotter( ctrl, hamiltonians, self.threads )
             
         elif method == 'dyson':
-            U = integration.dyson( self.control, \
-                self.hamiltonians, self.order )
+            U = integration.dyson( ctrl, hamiltonians, self.order )
             
         elif method == 'magnus':
-            U = integration.magnus( self.control, \
-                self.hamiltonians, self.order )
+            U = integration.magnus( ctrl, hamiltonians, self.order )
             
         elif method == 'lindblad':
-            U = integration.lindblad( self.control, \
-                self.hamiltonians, self.lindblad )
+            U = integration.lindblad( ctrl, hamiltonians, self.lindblad )
+
+        elif method in ['midpoint', 'yoshida', 'cfm4']:
+            U = integration.splitting( ctrl, hamiltonians, method )
+
+        elif method == 'adaptive':
+            U = integration.adaptive( ctrl, hamiltonians, self.tolerance )
+
+        elif method == 'adjoint':
+            [R, basis] = self.adjoint()
+            U = operator( integration.adjoint_unitary( R[-1], basis ) )
             
         else:
             raise ValueError('Method %s was not understood.' %method)
@@ -344,39 +433,150 @@ class propagator:
         return U
 
 
+    def _bilinear(self):
+        # The control and Hamiltonians of the bilinear system.  A drift
+        # is appended as a Hamiltonian with a constant control.
+        if self.drift is None:
+            return [self.control, self.hamiltonians]
+
+        arr = self.control.control
+        t = asarray( self.control.times, float ).reshape( (-1, 1) )
+        ctrl = control.control( hstack(( arr, ones( (len(arr), 1) ), t )), \
+                                interpolation = self.control.interpolation )
+        return [ctrl, _hamiltonians( list( self.hamiltonians ) + [self.drift] )]
+
+
     def components(self, *args):
         """
-        Calculates components of generator on the Lie algebra.
-        """
+        Calculates components of generator on the Lie algebra.  The
+        generator :math:`G` of the propagator, :math:`U = \\exp( -i G
+        )`, is expanded in the Hamiltonians, :math:`G = \\sum_\\mu
+        u_\\mu H_\\mu`.  The expansion is a least squares fit when
+        :math:`G` does not lie in the span of the Hamiltonians.
 
-        # Skew-symmetrize current Hamiltonians
-        H = []
-        for index in range(len( self.hamiltonians )):
-            H.append( -1j * self.hamiltonians[index] )
+        For single qubits the generator is found in closed form, see
+        ``su2.rotation_vector()``.  Otherwise a matrix logarithm is
+        used.
 
-        # Generate an orthanormal set of skew-symmetrized Hamiltonians
-        # that span the Lie algebra.
-        A = routines.generate_algebra( self.hamiltonians )
+        **Returns:**
 
-        # Decompose log(U) into A basis
+           * u : An array of k components.
+        """
         U = self.solve()
-        logU = operator( logm(U) )
-        
-        a = zeros( len(A) )
-        for v in range( len(A) ):
-            a[v] = routines.inner_product( logU, A[v] )
-
-        # Calculate covectors in original oblique basis
-        print a
-        u = zeros( len(H) )
-        for mu in range(len(H)):
-            
-            for v in range( len(A) ):
-                u[v] = u[v] + a[v] / routines.inner_product(A[v],H[mu])
+        if U.shape == (2,2):
+            G = einsum( 'k,kab->ab', su2.rotation_vector( U ), \
+                        asarray( [Hx,Hy,Hz] ) )
+        else:
+            G = 1j * logm( U )
+
+        # Least squares in the Hilbert-Schmidt inner product.
+        H = asarray( self.hamiltonians, complex )
+        M = H.reshape( len(H), -1 ).T
+        u = lstsq( M, asarray( G ).flatten() )[0]
+
+        return real( u )
+
+
+    def evolve(self, state, order = 2):
+        """
+        Propagates states through the control problem without forming
+        the propagator.  See ``integration.evolve()``.  For local
+        operators ``integration.local_evolve()`` is used.
+
+        **Forms:**
+
+           * ``evolve( psi )``
+           * ``evolve( psi, order = n )``
+
+        **Args:**
+
+           * *psi* : An N-element state vector, or an (N, m) array
+             whose columns are m state vectors.
 
-        return u[v]
+        **Optional keys:**
+
+           * order = n : Order of the splitting between local
+             operators, either 1 or 2.
+
+        **Returns:**
+
+           * psi : The states at the final time.
+        """
+        [ctrl, hamiltonians] = self._bilinear()
+        if local_operator.is_local( hamiltonians ):
+            return integration.local_evolve( ctrl, hamiltonians, state, order )
+        return integration.evolve( ctrl, hamiltonians, state )
+
+
+    def adjoint(self):
+        """
+        Solves the control problem in the adjoint representation.  The
+        propagator at each sampled time is represented by a real
+        orthogonal m x m matrix, where m is the dimension of the
+        dynamical Lie algebra.  See ``integration.adjoint()``.
+
+        **Returns:**
+
+           * [R, basis] : R is an (n, m, m) array, such that
+             :math:`U^\\dagger(t) B_a U(t) = \\sum_b R_{ab}(t) B_b`
+             for each of the n sampled times.  basis holds the
+             :math:`B_a`, starting with the Hamiltonians.
+        """
+        [ctrl, hamiltonians] = self._bilinear()
+        return integration.adjoint( ctrl, hamiltonians )
+
+
+    def bloch(self, state):
+        """
+        Calculates the trajectory of a state in the adjoint
+        representation.  The expectation values of the basis operators
+        evolve as :math:`\\langle B_a \\rangle(t) = \\sum_b R_{ab}(t)
+        \\langle B_b \\rangle(0)`, so no unitaries are formed.
+
+        **Forms:**
+
+           * ``bloch( psi )``
+           * ``bloch( rho )``
+
+        **Args:**
+
+           * *psi* : An N-element initial state vector.
+           * *rho* : An N x N initial density matrix.
+
+        **Returns:**
+
+           * r : An (n, m) array of expectation values of the basis
+             operators returned by ``adjoint()`` at each of the n
+             sampled times.  For a single qubit with the product
+             operators :math:`[H_x, H_y, H_z]` these are half the
+             components of the Bloch vector.
+        """
+        rho = asarray( state, complex )
+        if rho.ndim == 1 or min( rho.shape ) == 1:
+            psi = rho.flatten()
+            rho = outer( psi, psi.conj() )
+
+        [R, basis] = self.adjoint()
+        r0 = einsum( 'ij,aji->a', rho, basis ).real
+        return einsum( 'jab,b->ja', R, r0 )
     
 
+def _hamiltonians( hamiltonians ):
+    # Local operators are kept as a list, so that no register sized
+    # matrices are formed.  Other Hamiltonians form a hamiltonian_set.
+    if local_operator.is_local( hamiltonians ):
+        return list( hamiltonians )
+    return hamiltonian_set.hamiltonian_set( hamiltonians )
+
+
+def _same_drift( a, b ):
+    # Drifts match when both are absent or both are equal.
+    if a is None or b is None:
+        return a is None and b is None
+    return asarray( a ).shape == asarray( b ).shape and \
+           ( asarray( a ) == asarray( b ) ).all()
+
+
 def rotation( *args, **keyword_args ):
     """
     A function to form propagators that represent rotations in SU(2).
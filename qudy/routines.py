@@ -21,12 +21,25 @@
 
 
 from quantop import *
-from numpy import all
+from numpy import all, asarray, einsum, matmul, angle, where, dot, \
+     empty, nonzero, roll
+from numpy.linalg import eigvals, matrix_rank, matrix_power
+from scipy.linalg import qr
+import su2
+import pauli
+import hamiltonian_set
 
 __all__ = ['inner_product','projection','norm','decomp','trace_distance', \
-           'fidelity','infidelity','gram_schmidt','commutator',    \
+           'fidelity','infidelity','average_gate_fidelity',         \
+           'process_fidelity','gram_schmidt','commutator',          \
            'product_operator','generate_algebra',   \
-           'structure_constants','euler_decomposition']
+           'structure_constants','euler_decomposition','leakage',    \
+           'subspace_projection','subspace_fidelity','gell_mann','weyl']
+
+# Product operator and Gell-Mann bases, keyed by the number of qubits
+# and the number of levels.
+_product_operators = {}
+_gell_mann = {}
 
 # ******************************************************
 # Distance Measures                                    *
@@ -88,7 +101,7 @@ def decomp(A):
     """
     Decomposes a matrix U in SU(2) into coefficents (ax,ay,az) such
     that U = exp( -i/2 * (ax * X + ay * Y + az * Z) ).  This function
-    does not use matrix logrithms.
+    does not use matrix logrithms, see ``su2.rotation_vector()``.
 
     **Forms:**
 
@@ -103,21 +116,7 @@ def decomp(A):
        * [ax,ay,az] : a list of coefficients
     """
 
-    # Check whether input is in SU(2)
-    if not real( det(A) ) == 1:
-        
-        # Adjust global phase so that determinant is 1.
-        phase = 1j/2.0 * log( det(A) )
-        A = exp( 1j * phase ) * A
-
-    alpha = 2*arccos( real( A[0,0] ) )
-    beta  = - sin( alpha / 2.0 )
-
-    # Find components
-    ax = alpha/beta * imag( A[0,1] )
-    ay = alpha/beta * real( A[0,1] )
-    az = alpha/beta * imag( A[0,0] )
-
+    [ax,ay,az] = su2.rotation_vector( A )
     return [ax,ay,az]
     
 
@@ -156,19 +155,26 @@ def fidelity(A, B):
        
     **Args:**
     
-       * *A* : a N x N dimensional matrix
-       * *B* : a N x N dimensional matrix
+       * *A* : a N x N dimensional matrix, or a (M, N, N) array of
+         matrices.
+       * *B* : a N x N dimensional matrix, or a (M, N, N) array of
+         matrices.
        
     **Returns:**
     
-       * fidlty : fidelity measure between input matrices.
+       * fidlty : fidelity measure between input matrices.  For
+         stacks of matrices an array of M fidelities is returned.
+         A single matrix is compared against every member of a stack.
+
+    For 2 x 2 matrices the closed form ``su2.fidelity()`` is used.
     """
-    [q,Q] = eig(A.H * B)
-    # print q
-    f = 1j* log(q)
-    f = f - min(f)
-    fidlty = min( abs( cos( f/2.0 ) ) )
-    return float( real(fidlty) )
+    if asarray( A ).shape[-1] == 2:
+        return _result( su2.fidelity( A, B ), A, B )
+
+    f = - _eigenphases( A, B )
+    f = f - f.min( axis = -1 )[...,None]
+    fidlty = abs( cos( f/2.0 ) ).min( axis = -1 )
+    return _result( fidlty, A, B )
 
 
 def infidelity(A, B):
@@ -183,27 +189,192 @@ def infidelity(A, B):
        
     **Args:**
        
-       * *A* : a N x N dimensional matrix
-       * *B* : a N x N dimensional matrix
+       * *A* : a N x N dimensional matrix, or a (M, N, N) array of
+         matrices.
+       * *B* : a N x N dimensional matrix, or a (M, N, N) array of
+         matrices.
        
     **Returns:**
     
-       * infd : infidelity measure between input matrices.
+       * infd : infidelity measure between input matrices.  For
+         stacks of matrices an array of M infidelities is returned.
+
+    For 2 x 2 matrices the closed form ``su2.infidelity()`` is used.
     """
-    [q,Q] = eig(A.H * B)
-    f = real( 1j * log(q) )
-    f = f - mean(f)
+    if asarray( A ).shape[-1] == 2:
+        return _result( su2.infidelity( A, B ), A, B )
+
+    f = - _eigenphases( A, B )
+    f = f - f.mean( axis = -1 )[...,None]
     
     # Remove over rotations
     #for index in range(len(f)):
     #    if abs( f[index] ) > pi/2.0:
     #        f[index] = f[index]%(pi/2.0)
         
-    dst = 2*max( sin(f/2) )
+    dst = 2 * sin( f/2 ).max( axis = -1 )
     infd = dst**2 / 2
-    if infd > 1:
-        infd = 2.0 - infd
-    return infd
+    infd = where( infd > 1, 2.0 - infd, infd )
+    return _result( infd, A, B )
+
+
+def average_gate_fidelity(A, B):
+    """
+    Calculates the average gate fidelity between two unitaries,
+    averaged over the Haar measure on pure states.
+
+    **Forms:**
+
+       * ``average_gate_fidelity( A, B )``
+
+    **Args:**
+
+       * *A* : a N x N dimensional matrix, or a (M, N, N) array of
+         matrices.
+       * *B* : a N x N dimensional matrix, or a (M, N, N) array of
+         matrices.
+
+    **Returns:**
+
+       * fidlty : :math:`( |\\mathrm{tr}(A^\\dagger B)|^2 + N ) /
+         ( N (N + 1) )`.  For stacks of matrices an array of M
+         fidelities is returned.
+    """
+    N = asarray( A ).shape[-1]
+    fidlty = ( N**2 * process_fidelity( A, B ) + N ) / ( N * ( N + 1.0 ) )
+    return fidlty
+
+
+def process_fidelity(A, B):
+    """
+    Calculates the process (entanglement) fidelity between two
+    unitaries.  Only the trace of :math:`A^\\dagger B` is needed, so
+    no eigendecomposition is performed.
+
+    **Forms:**
+
+       * ``process_fidelity( A, B )``
+
+    **Args:**
+
+       * *A* : a N x N dimensional matrix, or a (M, N, N) array of
+         matrices.
+       * *B* : a N x N dimensional matrix, or a (M, N, N) array of
+         matrices.
+
+    **Returns:**
+
+       * fidlty : :math:`|\\mathrm{tr}(A^\\dagger B)|^2 / N^2`.  For
+         stacks of matrices an array of M fidelities is returned.
+    """
+    [a, b] = [ asarray( A ), asarray( B ) ]
+    N = a.shape[-1]
+    if a.ndim == 2 and b.ndim == 3:
+        tr = einsum( 'ij,...ij->...', a.conj(), b )
+    elif a.ndim == 3 and b.ndim == 2:
+        tr = einsum( '...ij,ij->...', a.conj(), b )
+    else:
+        tr = einsum( '...ij,...ij->...', a.conj(), b )
+    fidlty = abs( tr )**2 / float( N**2 )
+    return _result( fidlty, A, B )
+
+
+def subspace_projection( U, levels = [0, 1] ):
+    """
+    Projects an operator onto a subspace of the basis states, for
+    instance the qubit levels of a multi-level system.
+
+    **Forms:**
+
+       * ``subspace_projection( U )``
+       * ``subspace_projection( U, levels )``
+
+    **Args:**
+
+       * *U* : a N x N dimensional matrix, or a (M, N, N) array of
+         matrices.
+       * *levels* : The m basis states which span the subspace.  The
+         default is the lowest two levels.
+
+    **Returns:**
+
+       * V : The m x m block :math:`P U P^\\dagger`, where :math:`P` is
+         the projector onto the subspace.  V is not unitary when U
+         leaks out of the subspace.
+    """
+    levels = asarray( levels, int )
+    return asarray( U )[...,levels[:,None],levels[None,:]]
+
+
+def leakage(U, levels = [0, 1]):
+    """
+    Calculates the leakage of a gate out of a subspace, averaged over
+    the states of the subspace.
+
+    **Forms:**
+
+       * ``leakage( U )``
+       * ``leakage( U, levels )``
+
+    **Args:**
+
+       * *U* : a N x N dimensional matrix, or a (M, N, N) array of
+         matrices.
+       * *levels* : The m basis states which span the subspace.  The
+         default is the lowest two levels.
+
+    **Returns:**
+
+       * L : :math:`1 - \\| P U P^\\dagger \\|^2 / m`, the mean
+         population which leaves the subspace.  For stacks of matrices
+         an array of M values is returned.
+    """
+    V = subspace_projection( U, levels )
+    L = 1.0 - ( abs( V )**2 ).sum( axis = (-2,-1) ) / float( V.shape[-1] )
+    return _result( L, U, U )
+
+
+def subspace_fidelity(A, U, levels = [0, 1]):
+    """
+    Calculates the process fidelity of a gate on a subspace, such as
+    the qubit levels of a transmon.  Leakage lowers the fidelity.
+
+    **Forms:**
+
+       * ``subspace_fidelity( A, U )``
+       * ``subspace_fidelity( A, U, levels )``
+
+    **Args:**
+
+       * *A* : the m x m target gate.
+       * *U* : a N x N dimensional matrix, or a (M, N, N) array of
+         matrices.
+       * *levels* : The m basis states which span the subspace.  The
+         default is the lowest two levels.
+
+    **Returns:**
+
+       * fidlty : :math:`|\\mathrm{tr}(A^\\dagger P U P^\\dagger)|^2 /
+         m^2`.  See ``process_fidelity()``.
+    """
+    return process_fidelity( A, subspace_projection( U, levels ) )
+
+
+def _eigenphases( A, B ):
+    # Eigenphases of A^dagger B, found with one batched call for
+    # stacks of matrices.  Phases are measured from the first
+    # eigenvalue, so that a global phase near pi does not straddle
+    # the branch cut.
+    a = asarray( A )
+    q = eigvals( matmul( a.conj().swapaxes(-1,-2), asarray( B ) ) )
+    return angle( q * q[...,0:1].conj() )
+
+
+def _result( value, A, B ):
+    # Return a float for a single pair of matrices.
+    if asarray( A ).ndim == 2 and asarray( B ).ndim == 2:
+        return float( value )
+    return value
 
 
 def gram_schmidt( vectors ):
@@ -261,11 +432,16 @@ def commutator(A, B):
     **Returns:**
     
        *  : commutator between input matrices.
+
+    For two Pauli strings the commutator is found from their bit
+    masks, and is returned as a Pauli string.
     """
+    if isinstance( A, pauli.pauli ) and isinstance( B, pauli.pauli ):
+        return A.commutator( B )
     return A*B - B*A
 
 
-def product_operator( number_qubits ):
+def product_operator( number_qubits, representation = 'dense' ):
     """
     A function to generate product operators.  The product operator
     representation is a set of orthogonal Hamiltonians which span the
@@ -275,6 +451,8 @@ def product_operator( number_qubits ):
     **Forms:**
     
        * `product_operator( number_qubits )`
+       * `product_operator( number_qubits, representation = 'pauli' )`
+       * `product_operator( number_qubits, representation = 'set' )`
        
     **Args:**
     
@@ -282,6 +460,11 @@ def product_operator( number_qubits ):
          This input specifies the dimensionality of the Lie algebra, 
          :math:`4^n - 1` and the dimensionality of the Hilbert space,
          :math:`2^n`.
+       * *representation* : Either 'dense', for operator matrices,
+         'pauli', for instances of the pauli class, or 'set', for a
+         hamiltonian_set.  Pauli strings are stored as bit masks and
+         no matrices are formed.  The matrices are built once for
+         each number of qubits and cached.
          
     **Raises:**
     
@@ -296,105 +479,306 @@ def product_operator( number_qubits ):
     conventions.
     """
     
-    # Wrapper function for Pauli operators
-    def s(x):
-        if x == 0:
-            return operator([[1,0],[0,1]])
-        elif x == 1:
-            return operator([[0,1],[1,0]])
-        elif x == 2:
-            return operator([[0,-1j],[1j,0]])
-        elif x == 3:
-            return operator([[1,0],[0,-1]])
-        else:
-            raise Exception("Could not understand input.")
-    
     # Check that number_qubits is an integer value.
     if not number_qubits % 1 == 0:
-        ValueError('An integer number of qubits is required.')
-        
+        raise ValueError('An integer number of qubits is required.')
         
     # Create a list of the product operators.  Uses convention in NJP
-    # 12 015002 (2010)
-    prod_operators = []
-    for j in range( 1, int(4**number_qubits - 1 + 1) ):
-        
-        eta_j = operator("1")
-        for k in range( 1, int(number_qubits + 1) ):
-            index = floor( (j % (4**k)) / 4**(k-1) )
-            sk = s(index)
-            eta_j = eta_j | sk    # Tensor product together
-            
-        prod_operators.append(0.5 * eta_j)
-        
-    return prod_operators
+    # 12 015002 (2010).  Each product operator is a signed permutation
+    # matrix, which is filled in directly from its Pauli string.
+    if representation == 'pauli':
+        return pauli.pauli_basis( number_qubits )
+
+    n = int( round( number_qubits ) )
+    if not n in _product_operators:
+        _product_operators[n] = hamiltonian_set.hamiltonian_set( \
+            [ h.dense() for h in pauli.pauli_basis( n ) ] )
+
+    if representation == 'set':
+        return _product_operators[n]
+
+    elif representation == 'dense':
+        # Copies, so that the cached set is never modified.
+        return [ operator( h ) for h in _product_operators[n].array ]
+    
+    else:
+        raise ValueError('Representation %s not understood.' %(representation))
+
+
+def gell_mann( dimension, representation = 'dense' ):
+    """
+    A function to generate the generalized Gell-Mann matrices.  These
+    are a set of orthogonal Hamiltonians which span the Lie algebra
+    :math:`su(d)`, the dynamical Lie algebra of a single d-level
+    system.
+
+    **Forms:**
+
+       * `gell_mann( dimension )`
+       * `gell_mann( dimension, representation = 'set' )`
+
+    **Args:**
+
+       * *dimension* : number of levels d.
+       * *representation* : Either 'dense', for operator matrices, or
+         'set', for a hamiltonian_set.  The matrices are built once
+         for each dimension and cached.
+
+    **Raises:**
+
+       * `ValueError` : An integer dimension of at least 2 is required.
+
+    **Returns:**
 
+       * basis : A list of the :math:`d^2 - 1` Hamiltonians.
 
-def generate_algebra( hamiltonians, max_depth = 10 ):
+    For each level k the symmetric and antisymmetric matrices coupling
+    k to the lower levels are followed by the k-th diagonal matrix, so
+    that for d = 3 the usual Gell-Mann order is recovered.  The
+    matrices are scaled by one half, :math:`\\mathrm{tr}( H_a H_b ) =
+    \\delta_{ab} / 2`, which for d = 2 gives the product operators.
+    """
+    if not dimension % 1 == 0 or dimension < 2:
+        raise ValueError('An integer dimension of at least 2 is required.')
+
+    d = int( dimension )
+    if not d in _gell_mann:
+        basis = []
+        for k in range( 1, d ):
+            for j in range( k ):
+                S = zeros( (d, d), complex )
+                S[j,k] = S[k,j] = 0.5
+                A = zeros( (d, d), complex )
+                A[j,k] = -0.5j
+                A[k,j] = 0.5j
+                basis = basis + [S, A]
+            D = zeros( (d, d), complex )
+            D[range( k ), range( k )] = 1.0
+            D[k,k] = -k
+            basis.append( D / sqrt( 2.0 * k * ( k + 1 ) ) )
+        _gell_mann[d] = hamiltonian_set.hamiltonian_set( basis )
+
+    if representation == 'set':
+        return _gell_mann[d]
+
+    elif representation == 'dense':
+        return [ operator( h ) for h in _gell_mann[d].array ]
+
+    else:
+        raise ValueError('Representation %s not understood.' %(representation))
+
+
+def weyl( dimension ):
+    """
+    A function to generate the Weyl (clock and shift) operators of a
+    d-level system, :math:`X^a Z^b` with :math:`X|j\\rangle = |j +
+    1\\rangle` and :math:`Z|j\\rangle = \\omega^j |j\\rangle`, where
+    :math:`\\omega = e^{2 \\pi i / d}`.  They are unitary, not
+    Hermitian, and with the identity form an orthogonal basis for all
+    d x d matrices.  For d = 2 they are the Pauli matrices, up to
+    phases.
+
+    **Args:**
+
+       * *dimension* : number of levels d.
+
+    **Returns:**
+
+       * basis : A list of the :math:`d^2 - 1` operators with
+         :math:`(a, b) \\neq (0, 0)`, ordered by a and then by b.
+    """
+    if not dimension % 1 == 0 or dimension < 2:
+        raise ValueError('An integer dimension of at least 2 is required.')
+
+    d = int( dimension )
+    X = roll( eye( d ), 1, axis = 0 )
+    Z = diag( exp( 2j * pi * arange( d ) / d ) )
+    return [ operator( dot( matrix_power( X, a ), matrix_power( Z, b ) ) ) \
+             for a in range( d ) for b in range( d ) if a or b ]
+
+
+def generate_algebra( hamiltonians, max_depth = 100, tol = 1E-10 ):
     """
     Produces a set of skew-symmeterized Hamiltonians which completely
     span the dynamical algebra from an initial seed set.  The
     Hamiltonians act as generators, i.e. the algebra is produced by
     repeated brackets [-iH,-iH].
+
+    **Forms:**
+
+       * ``generate_algebra( hamiltonians )``
+       * ``generate_algebra( hamiltonians, max_depth, tol )``
+
+    **Args:**
+
+       * *hamiltonians* : A list or array of N x N Hamiltonians.
+       * *max_depth* : Largest number of nested brackets.
+       * *tol* : A bracket is added to the basis when the norm of its
+         part orthogonal to the basis exceeds tol times its norm.
+
+    **Raises:**
+
+       * ``ValueError`` : The algebra did not close within max_depth
+         nested brackets.
+
+    **Returns:**
+
+       * basis : An (m, N, N) array of skew-Hermitian matrices,
+         orthonormal in the Hilbert-Schmidt inner product.
+
+    Only the brackets of the elements added at the previous depth are
+    formed, all at once, and they are orthogonalized against the
+    basis with a pivoted QR decomposition.
+
+    When the Hamiltonians are Pauli strings, the algebra is found
+    from their bit masks and is returned as a list of Pauli strings.
     """
+    if pauli.is_pauli( hamiltonians ):
+        return pauli.generate_algebra( hamiltonians )
     
     # Take the list of Hamiltonians and convert them to generators.
-    generators = []
-    for h in hamiltonians:
-        generators.append( -1j * h )
-        
+    generators = -1j * asarray( [ asarray( h, complex ) for h in hamiltonians ] )
+    N = generators.shape[-1]
+
     # Orthanormalize the set
-    generators = gram_schmidt( generators )
-    brackets = generators[:]
+    basis = _extend_basis( zeros( (0, 2*N*N) ), generators, tol )
+    new = _unflatten( basis, N )
     
     for depth in range(1, max_depth + 1):
         
-        # Measure dimension of original set
-        dimension = len(brackets)
+        # Brackets of the new elements with every generator.
+        brackets = matmul( new[:,None], generators[None,:] ) - \
+                   matmul( generators[None,:], new[:,None] )
         
-        # Calculate new lie brackets
-        new_brackets = []
-
-        for b in brackets:
-            for g in generators:
-                
-                new_brackets.append( commutator(b,g) )
-                
-        # Orthogonalize the list of brackets to build a larger basis.
-        # This throws out repeat brackets.
-        brackets = gram_schmidt( brackets + new_brackets )
+        # Orthogonalize the brackets against the basis.  This throws
+        # out repeat brackets.
+        added = _extend_basis( basis, brackets.reshape( -1, N, N ), tol )
         
-        if len(brackets) == dimension:
-            
-            # print "Converged at depth k = %i." %(depth)
-            # print "Algebra dimension d = %i." %(dimension)
-            return brackets
+        if len( added ) == 0:
+            return _unflatten( basis, N )
+        
+        basis = vstack(( basis, added ))
+        new = _unflatten( added, N )
         
     # Must not have converged
     raise ValueError("Failed to converge at depth k = %i.\n" %(depth) + \
-                     "Algebra dimension d > %i." %( len(brackets) ))
-    
-    return brackets
+                     "Algebra dimension d > %i." %( len(basis) ))
+
+
+def _extend_basis( basis, matrices, tol ):
+    # Orthonormal vectors spanning the part of matrices orthogonal to
+    # basis.  Skew-Hermitian matrices are stored as real vectors of
+    # their real and imaginary parts, so that the Euclidean inner
+    # product is the Hilbert-Schmidt inner product and the basis
+    # remains skew-Hermitian.
+    M = matrices.reshape( len(matrices), -1 )
+    V = hstack(( real( M ), imag( M ) ))
+    size = sqrt( ( V**2 ).sum( axis = 1 ) )
+    V = V[ size > tol * size.max() ] / size[ size > tol * size.max() ][:,None]
+
+    # Project out the basis twice, for numerical stability.  Drop
+    # the brackets that already lie in the span of the basis.
+    for sweep in range(2):
+        if len(basis):
+            V = V - dot( dot( V, basis.T ), basis )
+    V = V[ sqrt( ( V**2 ).sum( axis = 1 ) ) > tol ]
+    if len(V) == 0:
+        return zeros( (0, basis.shape[1]) )
 
+    [Q, R, P] = qr( V.T, mode = 'economic', pivoting = True )
+    rank = ( abs( diag( R ) ) > tol ).sum()
+    return Q[:, 0:rank].T
 
-def structure_constants( hamiltonians ):
+
+def _unflatten( basis, N ):
+    # Matrices from the real vectors used by _extend_basis.
+    return ( basis[:, 0:N*N] + 1j * basis[:, N*N:] ).reshape( -1, N, N )
+
+
+def structure_constants( hamiltonians, sparse = False, tol = 1E-10 ):
     """
-    Calculates structure constants for dynamical Lie algebra.  Not
-    currently implemented.
-    
-    .. todo::
-       
-       Implement algorithm to measure structure constants from a set
-       of operators that span an algebra.
+    Calculates structure constants for dynamical Lie algebra,
+    :math:`-i [H_a, H_b] = \\sum_c f_{abc} H_c`.
+
+    **Forms:**
+
+       * ``structure_constants( hamiltonians )``
+       * ``structure_constants( hamiltonians, sparse = True )``
+
+    **Args:**
+
+       * *hamiltonians* : A list or array of m linearly independent
+         N x N matrices, closed under commutation, or a list of Pauli
+         strings.
+       * *sparse* : Boolean flag.  When True the non-zero constants
+         are returned as ``[index, values]``, where index is an
+         (nnz, 3) array of (a, b, c) triples.
+       * *tol* : Constants smaller than tol are dropped from sparse
+         output, and commutators may differ from their projection by
+         tol relative to their norm.
+
+    **Raises:**
+
+       * ``ValueError`` : The matrices are linearly dependent, or are
+         not closed under commutation.
+
+    **Returns:**
+
+       * f : An (m, m, m) array of structure constants.  The array is
+         real for Hermitian matrices.
+
+    The commutators of every pair are formed in batches and projected
+    onto the matrices with the inverse of their Gram matrix, using one
+    einsum per batch.  For product operators, and other bases of
+    scaled Pauli strings, the constants are read from the Pauli
+    multiplication table instead, see ``pauli.structure_constants``.
     """
-    return NotImplemented
+    if not pauli.is_pauli( hamiltonians ):
+        strings = [ pauli.from_matrix( h ) for h in hamiltonians ]
+        if not None in strings and pauli.is_pauli( strings ):
+            hamiltonians = strings
+
+    if pauli.is_pauli( hamiltonians ):
+        return pauli.structure_constants( hamiltonians, sparse )
+
+    H = asarray( [ asarray( h, complex ) for h in hamiltonians ] )
+    [m, N] = [ len(H), H.shape[-1] ]
+    Hc = H.conj()
+
+    gram = einsum( 'aij,bij->ab', Hc, H )
+    if matrix_rank( gram, tol * abs( gram ).max() ) < m:
+        raise ValueError('Hamiltonians must be linearly independent.')
+    ginv = inv( gram )
+
+    # Commutators of a batch of rows a with every b, sized to keep
+    # the batch near a few million elements.
+    f = empty( (m, m, m), complex )
+    size = max( 1, int( 2**22 / ( m * N * N ) ) )
+    for start in range( 0, m, size ):
+        A = H[start:start+size]
+        C = -1j * ( matmul( A[:,None], H[None,:] ) - matmul( H[None,:], A[:,None] ) )
+        p = einsum( 'cij,abij->abc', Hc, C )
+        f[start:start+size] = einsum( 'abd,cd->abc', p, ginv )
+
+        # Part of each commutator outside the span.
+        norm2 = ( abs( C )**2 ).sum( axis = (2,3) )
+        proj2 = real( einsum( 'abc,abc->ab', p.conj(), f[start:start+size] ) )
+        if ( norm2 - proj2 > tol * ( 1.0 + norm2 ) ).any():
+            raise ValueError('Hamiltonians are not closed under commutation.')
+
+    if abs( f.imag ).max() <= tol * max( abs( f ).max(), 1.0 ):
+        f = f.real
+
+    if sparse:
+        index = array( nonzero( abs( f ) > tol ) ).T
+        return [ index, f[ tuple( index.T ) ] ]
+    return f
 
 
 def euler_decomposition( U ):
     """
     Decompose a unitary in :math:`U(2)` into a set of three Euler
-    angles.  We use the XYX Euler angle convention.  I think it only
-    works for out of plane rotations (all I care about actually).
+    angles.  We use the XYX Euler angle convention.
     
     **Forms:**
     
@@ -409,42 +793,15 @@ def euler_decomposition( U ):
     
        * `[alpha,beta,gamma]` : Euler angles for the decomposition.
          The original input matrix may be reconstructed by :math:`U =
-         R_x(\\gamma) R_y(\\beta) R_x(\\alpha)`.
-         
-    .. todo::
-       
-       Check stability of algorithm for rotations in the plane.  Check
-       that elements U(2) are mapped correctly to equivalent elements
-       in SU(2).
+         R_x(\\gamma) R_y(\\beta) R_x(\\alpha)`, up to a global
+         phase.
     """
     
-    # Check to see if U is in SU(2).  If it is not, but still
-    # two-dimensional, adjust the global phase so that det(U) = 1.
-    # Otherwise throw an error.
-    
     if not U.shape == (2,2):
         raise ValueError("Matrix must be two dimensional")
-    
-    if not det(U) == 1:
-        
-        # Adjust global phase so that determinant is 1.
-        phase = 1j/2.0 * log( det(U) )
-        U = exp( 1j * phase ) * U
-    
-    
-    H = product_operator( 1 )
-
-    # Components of U in Pauli basis
-    a1 = real( trace( U * operator("1,0;0,1") * 1/2.0 ) )
-    ax = real( 1j * trace( U * H[0] ) )
-    ay = real( 1j * trace( U * H[1] ) )
-    az = real( 1j * trace( U * H[2] ) )
 
-    # Calculate Euler angles
-    beta = 2 * arccos( sqrt( a1**2 + ax**2 ) )
-    plus = 2 * arcsin( ax / cos(beta/2.0) )  # gamma + alpha
-    minus = 2 * arccos( ay / sin(beta/2.0) ) # gamma - alpha
-    gamma = (plus + minus) / 2.0
-    alpha = (plus - minus) / 2.0
+    # Closed form on the Cayley-Klein parameters, see
+    # su2.euler_angles().
+    [alpha,beta,gamma] = su2.euler_angles( U )
 
     return [alpha,beta,gamma]
@@ -0,0 +1,247 @@
+# SU2.PY
+#
+# Closed form routines for single qubit gates
+#
+# Copyright (C) 2011, 2012 True Merrill
+# Georgia Institute of Technology
+# School of Chemistry and Biochemistry
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from quantop import *
+from numpy import asarray, arctan2, concatenate, cross, where, empty
+
+__all__ = ['cayley_klein','su2_matrix','quaternion_product', \
+           'rotation_angle','rotation_axis','rotation_vector', \
+           'euler_angles']
+
+# Every unitary U in U(2) is written, up to a global phase, as
+#
+#    U = q0 I - i ( q1 X + q2 Y + q3 Z )
+#
+# where X, Y, Z are the Pauli matrices and q is a real unit
+# 4-vector, the Cayley-Klein parameters.  The routines below act on
+# arrays of gates with shape (..., 2, 2), or on arrays of parameters
+# with shape (..., 4).  Angles are found with arctan2 rather than
+# arccos or arcsin, so that they remain accurate near the identity
+# and near rotations by pi.  The fidelity measures of this module
+# are used by ``routines.fidelity()`` and ``routines.infidelity()``
+# for 2 x 2 matrices.
+
+
+def cayley_klein( U ):
+    """
+    Cayley-Klein parameters of a unitary in U(2).  The global phase is
+    removed so that the determinant is 1.
+
+    **Forms:**
+
+       * ``cayley_klein( U )``
+
+    **Args:**
+
+       * *U* : A 2 x 2 unitary matrix, or an array of them with
+         shape (..., 2, 2).
+
+    **Returns:**
+
+       * q : An array of shape (..., 4) such that :math:`U = q_0 I -
+         i ( q_1 X + q_2 Y + q_3 Z )`.
+    """
+    U = asarray( U, complex )
+    if not U.shape[-2:] == (2,2):
+        raise ValueError('Matrix must be two dimensional.')
+
+    d = U[...,0,0] * U[...,1,1] - U[...,0,1] * U[...,1,0]
+    U = U / sqrt( d )[...,None,None]
+    q = [ U[...,0,0] + U[...,1,1], 1j * ( U[...,0,1] + U[...,1,0] ), \
+          U[...,1,0] - U[...,0,1], 1j * ( U[...,0,0] - U[...,1,1] ) ]
+    return real( concatenate( [ x[...,None] for x in q ], axis = -1 ) ) / 2.0
+
+
+def su2_matrix( q ):
+    """
+    Special unitary matrices from Cayley-Klein parameters.  Inverse
+    of ``cayley_klein()``.
+
+    **Args:**
+
+       * *q* : An array of shape (..., 4).
+
+    **Returns:**
+
+       * U : An array of shape (..., 2, 2).
+    """
+    q = asarray( q, float )
+    U = empty( q.shape[:-1] + (2,2), complex )
+    U[...,0,0] = q[...,0] - 1j * q[...,3]
+    U[...,1,1] = q[...,0] + 1j * q[...,3]
+    U[...,0,1] = - q[...,2] - 1j * q[...,1]
+    U[...,1,0] = q[...,2] - 1j * q[...,1]
+    return U
+
+
+def quaternion_product( a, b ):
+    """
+    Cayley-Klein parameters of the matrix product :math:`A B`.
+
+    **Args:**
+
+       * *a* : Parameters of A, an array of shape (..., 4).
+       * *b* : Parameters of B, an array of shape (..., 4).
+
+    **Returns:**
+
+       * c : Parameters of A B, an array of shape (..., 4).
+    """
+    a = asarray( a )
+    b = asarray( b )
+    c0 = a[...,0] * b[...,0] - ( a[...,1:] * b[...,1:] ).sum( axis = -1 )
+    c = a[...,0,None] * b[...,1:] + b[...,0,None] * a[...,1:] + \
+        cross( a[...,1:], b[...,1:] )
+    return concatenate( ( c0[...,None], c ), axis = -1 )
+
+
+def rotation_angle( U ):
+    """
+    Rotation angle of a gate, :math:`\\theta` in :math:`U = \\exp( -i
+    \\theta \\, \\hat{n} \\cdot \\vec{\\sigma} / 2 )`.  The angle lies
+    in :math:`[0, 2\\pi]`.
+
+    **Args:**
+
+       * *U* : A 2 x 2 unitary matrix, or an array of them.
+
+    **Returns:**
+
+       * theta : The rotation angle, or an array of angles.
+    """
+    q = cayley_klein( U )
+    return 2 * arctan2( _length( q[...,1:] ), q[...,0] )
+
+
+def rotation_axis( U ):
+    """
+    Rotation axis of a gate, the unit vector :math:`\\hat{n}` in
+    :math:`U = \\exp( -i \\theta \\, \\hat{n} \\cdot \\vec{\\sigma} /
+    2 )`.  The axis of the identity is taken to be the z axis.
+
+    **Args:**
+
+       * *U* : A 2 x 2 unitary matrix, or an array of them.
+
+    **Returns:**
+
+       * n : An array of shape (..., 3).
+    """
+    q = cayley_klein( U )
+    s = _length( q[...,1:] )
+    n = q[...,1:] / where( s > 0, s, 1.0 )[...,None]
+    n[...,2] = where( s > 0, n[...,2], 1.0 )
+    return n
+
+
+def rotation_vector( U ):
+    """
+    Rotation vector of a gate, :math:`\\vec{a} = \\theta \\hat{n}`,
+    such that :math:`U = \\exp( -\\frac{i}{2} ( a_x X + a_y Y + a_z Z
+    ) )` up to a global phase.  The vector is found without matrix
+    logarithms, and is accurate near the identity.
+
+    **Args:**
+
+       * *U* : A 2 x 2 unitary matrix, or an array of them.
+
+    **Returns:**
+
+       * a : An array of shape (..., 3).
+    """
+    q = cayley_klein( U )
+    s = _length( q[...,1:] )
+    theta = 2 * arctan2( s, q[...,0] )
+
+    # theta / sin(theta/2), with its limit at the identity.
+    small = s < 1E-8
+    factor = where( small, 2.0 / where( small, q[...,0], 1.0 ), \
+                    theta / where( small, 1.0, s ) )
+    return factor[...,None] * q[...,1:]
+
+
+def euler_angles( U ):
+    """
+    XYX Euler angles of a gate, such that :math:`U = R_x(\\gamma)
+    R_y(\\beta) R_x(\\alpha)` up to a global phase, where
+    :math:`R_n(\\theta) = \\exp( -i \\theta \\, \\hat{n} \\cdot
+    \\vec{\\sigma} / 2 )`.
+
+    **Args:**
+
+       * *U* : A 2 x 2 unitary matrix, or an array of them.
+
+    **Returns:**
+
+       * angles : An array of shape (..., 3) holding
+         :math:`(\\alpha, \\beta, \\gamma)`.
+
+    In terms of the Cayley-Klein parameters, :math:`\\gamma + \\alpha
+    = 2 \\arctan( q_1 / q_0 )`, :math:`\\gamma - \\alpha = 2 \\arctan(
+    q_3 / q_2 )` and :math:`\\tan( \\beta / 2 ) = \\sqrt{ q_2^2 +
+    q_3^2 } / \\sqrt{ q_0^2 + q_1^2 }`.  When :math:`\\beta` is 0 or
+    :math:`\\pi` only the sum or the difference is defined, and the
+    other is set to zero.
+    """
+    q = cayley_klein( U )
+    c = _length( q[...,0:2] )
+    s = _length( q[...,2:4] )
+
+    beta = 2 * arctan2( s, c )
+    plus = where( c > 1E-12, 2 * arctan2( q[...,1], q[...,0] ), 0.0 )
+    minus = where( s > 1E-12, 2 * arctan2( q[...,3], q[...,2] ), 0.0 )
+
+    gamma = ( plus + minus ) / 2.0
+    alpha = ( plus - minus ) / 2.0
+    return concatenate( ( alpha[...,None], beta[...,None], gamma[...,None] ), \
+                        axis = -1 )
+
+
+def fidelity( A, B ):
+    """
+    Closed form of ``routines.fidelity()`` for 2 x 2 matrices.  For a
+    single qubit the fidelity is :math:`|\\langle q_A, q_B \\rangle|`,
+    the overlap of the Cayley-Klein parameters.
+    """
+    return abs( _relative( A, B )[...,0] )
+
+
+def infidelity( A, B ):
+    """
+    Closed form of ``routines.infidelity()`` for 2 x 2 matrices,
+    :math:`1 - |c_0| = |\\vec{c}|^2 / ( 1 + |c_0| )`, where :math:`c`
+    are the Cayley-Klein parameters of :math:`A^\\dagger B`.  The
+    second form is used, which is accurate for small infidelities.
+    """
+    c = _relative( A, B )
+    return ( c[...,1:]**2 ).sum( axis = -1 ) / ( 1 + abs( c[...,0] ) )
+
+
+def _relative( A, B ):
+    # Cayley-Klein parameters of A^dagger B, normalized.
+    a = cayley_klein( A ) * array([ 1, -1, -1, -1 ])
+    c = quaternion_product( a, cayley_klein( B ) )
+    return c / _length( c )[...,None]
+
+
+def _length( v ):
+    # Euclidean length along the last axis.
+    return sqrt( ( v**2 ).sum( axis = -1 ) )